@@ -1,141 +1,1108 @@
+from collections import OrderedDict
 from pathlib import Path
+import asyncio
+import atexit
+import functools
+import heapq
+import inspect
 import json
+import logging
+import marshal
+import pickle
+import shutil
+import struct
 import time
 import tempfile
 import os
-from threading import RLock
-from typing import Any, Callable, Dict, Optional, List
+import weakref
+import zlib
+from threading import Event, Lock, RLock, Thread
+from typing import Any, Callable, Dict, Optional, List, Tuple
+
+from locking import FileLock, replace_file
 
 DEFAULT_CACHE_FILE = Path.home() / ".python_new_cache.json"
-_LOCK = RLock()
+STORAGE_FORMATS = ("json", "journal")
+# a journal is only compacted once it exceeds this size (and compact_ratio x snapshot)
+_COMPACT_MIN_BYTES = 64 * 1024
+# marks a cache miss, so that a cached None is still a hit
+_MISSING = object()
+# rough per-entry cost of the key quoting, "expires"/"updated" fields and framing
+_ENTRY_OVERHEAD = 64
+# files written by any codec but the legacy "json" one start with b"PYNC1 <codec>\n"
+_CODEC_MAGIC = b"PYNC1 "
+# journal records of those codecs: this byte, a 4-byte big-endian length, the encoded record
+_RECORD_MAGIC = b"\x00"
+
+
+class Codec:
+    """Serializes the cache's entry dict to bytes and back."""
+
+    name = ""
+    # decoding untrusted bytes cannot run code; unsafe codecs are only read by caches configured with them
+    safe = True
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, raw: bytes) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    def __init__(self, name: str = "json", indent: Optional[int] = 2):
+        self.name = name
+        self.indent = indent
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        separators = None if self.indent else (",", ":")
+        return json.dumps(data, ensure_ascii=False, indent=self.indent, separators=separators, default=str).encode("utf-8")
+
+    def decode(self, raw: bytes) -> Dict[str, Any]:
+        return json.loads(raw.decode("utf-8")) if raw else {}
+
+
+class PickleCodec(Codec):
+    """Keeps arbitrary Python values intact. Only load files you trust."""
+
+    name = "pickle"
+    safe = False
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        return pickle.dumps(dict(data), protocol=pickle.DEFAULT_PROTOCOL)
+
+    def decode(self, raw: bytes) -> Dict[str, Any]:
+        return pickle.loads(raw)
+
+
+class MarshalCodec(Codec):
+    """Fast for plain built-in values; the format may change between Python versions."""
+
+    name = "marshal"
+    safe = False
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        return marshal.dumps(dict(data))
+
+    def decode(self, raw: bytes) -> Dict[str, Any]:
+        return marshal.loads(raw)
+
+
+class ZlibCodec(Codec):
+    def __init__(self, inner: Codec, level: int = 6):
+        self.name = f"zlib-{inner.name}"
+        self.inner = inner
+        self.safe = inner.safe
+        self.level = level
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        return zlib.compress(self.inner.encode(data), self.level)
+
+    def decode(self, raw: bytes) -> Dict[str, Any]:
+        return self.inner.decode(zlib.decompress(raw))
+
+
+CODECS: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec) -> None:
+    """Make codec selectable by name (SimpleCache(codec=...)) and readable from file headers."""
+    CODECS[codec.name] = codec
+
+
+for _codec in (
+    JsonCodec(),
+    JsonCodec("json-compact", indent=None),
+    PickleCodec(),
+    MarshalCodec(),
+    ZlibCodec(JsonCodec("json-compact", indent=None)),
+    ZlibCodec(PickleCodec()),
+):
+    register_codec(_codec)
+# write-behind caches that still need a final flush at interpreter exit
+_WRITE_BEHIND: "weakref.WeakSet[SimpleCache]" = weakref.WeakSet()
+
+class _Histogram:
+    """Latency histogram with power-of-two microsecond buckets."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * 32  # bucket i: durations below 2**i microseconds
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), 31)] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1e3,
+            "max_ms": self.max * 1e3,
+            "buckets": {f"<{(1 << i) / 1e3:g}ms": n for i, n in enumerate(self.buckets) if n},
+        }
+
+
+class _Metrics:
+    """Counters and latency histograms collected when SimpleCache(metrics=True)."""
+
+    COUNTERS = ("hits", "misses", "expirations", "evictions", "computes", "bytes_written")
+
+    def __init__(self):
+        self.hits = self.misses = self.expirations = self.evictions = 0
+        self.computes = self.bytes_written = 0
+        self.load = _Histogram()
+        self.save = _Histogram()
+        self.atomic_write = _Histogram()
+
+    def snapshot(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {name: getattr(self, name) for name in self.COUNTERS}
+        out["latency"] = {
+            "load": self.load.snapshot(),
+            "save": self.save.snapshot(),
+            "atomic_write": self.atomic_write.snapshot(),
+        }
+        return out
+
+
+def _fresh_error(exc: BaseException) -> BaseException:
+    """
+    A new instance of exc's type and args for one caller to raise. Raising the
+    stored instance itself would grow its traceback with every caller (and
+    from several threads at once); chain the copy to it with "from" instead.
+    """
+    try:
+        fresh = type(exc).__new__(type(exc), *exc.args)
+        fresh.__dict__.update(getattr(exc, "__dict__", {}))
+        return fresh
+    except Exception:
+        return exc
+
+
+class _Flight:
+    """A get_or_compute call in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = Event()
+        self.value: Any = None
+        self.error: Optional[Exception] = None
+
 
 class SimpleCache:
-    def __init__(self, path: Optional[Path] = None, max_entries: int = 500):
+    """
+    Small JSON-file backed key/value cache with optional per-key TTL.
+
+    By default every mutation rewrites the cache file (synchronous durability).
+    With write_behind=True mutations only mark the cache dirty; a background
+    flusher persists them every flush_interval seconds or as soon as
+    flush_after mutations have accumulated. flush() forces a write and a final
+    flush runs at interpreter exit.
+
+    Entries are kept in an ordered map in least-recently-used order and
+    expiry times in a min-heap, so TTL expiry and max_entries eviction cost
+    amortized O(log n) per operation instead of a scan/sort of the cache.
+
+    storage="journal" keeps the JSON file as a snapshot and appends set/delete
+    records to "<path>.log" instead of rewriting the file. Loading replays the
+    snapshot and then the log; a torn record at the end of the log (crash
+    mid-append) is dropped on its own. Once the log grows past compact_ratio
+    times the snapshot it is folded into a new snapshot on a background thread.
+
+    interprocess=True lets several processes share one cache file: writes
+    take an advisory lock on "<path>.lock" around read-modify-write, every
+    operation re-reads the file only when its (mtime, size, inode) changed,
+    and concurrent updates are merged per key by their "updated" timestamp
+    rather than the last writer replacing the whole file.
+
+    get_or_compute() is single-flight per key: one caller runs fn() while
+    concurrent callers for the same key wait for its result.
+
+    codec selects the file format (see CODECS): the default "json" writes the
+    original headerless pretty-printed JSON; other codecs prefix the file
+    with a header naming the codec. Files in another JSON-based codec load
+    regardless of the reader's codec; pickle/marshal files only load in a
+    cache configured with that codec and read as corrupt (empty) otherwise. With storage="journal" the
+    log records use the same codec (length-prefixed), except for "json",
+    which keeps one JSON line per record.
+
+    With max_bytes set, each entry's approximate serialized size (compact
+    JSON of key and value, or its pickled length when JSON cannot hold it,
+    plus a fixed overhead) is tracked and least recently used entries are
+    evicted until the total fits, bounding both memory and the file size.
+    stats() reports the current total ("bytes" is None without max_bytes).
+
+    metrics=True additionally counts hits, misses, expirations, evictions,
+    get_or_compute computations and bytes written, and records latency
+    histograms for _load, _save and _atomic_write (all included in stats()).
+    With metrics_dump set, stats() is appended as a JSON line to that file
+    every metrics_interval seconds and on close(). When metrics are off the
+    only cost is a None check.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_entries: int = 500,
+        max_bytes: Optional[int] = None,
+        write_behind: bool = False,
+        flush_interval: float = 1.0,
+        flush_after: int = 100,
+        storage: str = "json",
+        compact_ratio: float = 2.0,
+        interprocess: bool = False,
+        codec: Any = "json",
+        metrics: bool = False,
+        metrics_dump: Optional[Path] = None,
+        metrics_interval: float = 60.0,
+    ):
+        if storage not in STORAGE_FORMATS:
+            raise ValueError(f"unknown storage format: {storage!r}")
+        if interprocess and storage != "json":
+            raise ValueError("interprocess mode requires storage='json'")
         self.path = Path(path) if path else DEFAULT_CACHE_FILE
         self.max_entries = max_entries
-        self._data: Dict[str, Dict[str, Any]] = {}
+        self.max_bytes = max_bytes
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_after = flush_after
+        self.storage = storage
+        self.compact_ratio = compact_ratio
+        self.interprocess = interprocess
+        self.codec: Codec = CODECS[codec] if isinstance(codec, str) else codec
+        self._data: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         # structure: key -> {"value": ..., "expires": float|None, "updated": float}
+        # ordered least- to most-recently used
+        self._expiry: List[Tuple[float, str]] = []
+        # min-heap of (expires, key); entries made stale by set/delete are skipped lazily
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0  # sum of self._sizes
         self._loaded = False
+        self._lock = RLock()
+        self._io_lock = Lock()  # serializes file writes; held without self._lock
+        self._save_gen = 0
+        self._written_gen = 0
+        self._dirty = 0  # mutations not yet written to disk
+        self._mutations = 0  # mutations ever recorded; snapshots note how many they include
+        self._saved_mutations = 0
+        self._wake = Event()
+        self._flusher: Optional[Thread] = None
+        self._closed = False
+        # journal storage state
+        self._log_path = self.path.with_name(self.path.name + ".log")
+        self._journal: List[bytes] = []  # records not yet appended to the log
+        self._log_bytes = 0
+        self._snapshot_bytes = 0
+        self._compacting = False
+        self._compact_lock = Lock()
+        # interprocess state: what the file looked like when last read/written and
+        # which local changes have not been written yet
+        self._lock_path = self.path.with_name(self.path.name + ".lock")
+        self._disk_sig: Optional[Tuple[int, int, int]] = None
+        # key -> time of the local change (dicts: the module-level set() shadows the builtin)
+        self._touched: Dict[str, float] = {}
+        self._tombstones: Dict[str, float] = {}
+        self._cleared_at = 0.0
+        # get_or_compute coordination (in memory only)
+        self._inflight: Dict[str, _Flight] = {}
+        self._negative: Dict[str, Tuple[float, Exception]] = {}
+        self._metrics: Optional[_Metrics] = _Metrics() if metrics or metrics_dump else None
+        self.metrics_dump = Path(metrics_dump) if metrics_dump else None
+        self.metrics_interval = metrics_interval
+        self._dump_stop = Event()
+        if write_behind:
+            _WRITE_BEHIND.add(self)
+        if self.metrics_dump:
+            Thread(target=self._dump_loop, name="SimpleCache-metrics", daemon=True).start()
 
-    def _atomic_write(self, data: str) -> None:
+    def _atomic_write(self, data: bytes) -> None:
+        m = self._metrics
+        t0 = time.perf_counter() if m else 0.0
         self.path.parent.mkdir(parents=True, exist_ok=True)
         fd, tmp = tempfile.mkstemp(prefix=self.path.name, dir=str(self.path.parent))
         try:
-            with os.fdopen(fd, "w", encoding="utf-8") as f:
+            with os.fdopen(fd, "wb") as f:
                 f.write(data)
-            os.replace(tmp, str(self.path))
+            # retried while a lock-free reader (e.g. _refresh in another process) has it open
+            replace_file(tmp, str(self.path))
         finally:
             if os.path.exists(tmp):
                 try:
                     os.remove(tmp)
                 except Exception:
                     pass
+        if m:
+            m.atomic_write.add(time.perf_counter() - t0)
+            m.bytes_written += len(data)
+
+    def _read_file(self) -> Tuple[bytes, Dict[str, Any]]:
+        """Return (raw bytes, entries) of the cache file; a corrupted file reads as empty."""
+        raw = b""
+        try:
+            if self.path.exists():
+                raw = self.path.read_bytes()
+            obj = self._decode(raw)
+            # validate shape
+            return raw, obj if isinstance(obj, dict) else {}
+        except Exception:
+            # corrupted -> reset
+            return raw, {}
+
+    def _encode(self, data: Dict[str, Any]) -> bytes:
+        payload = self.codec.encode(data)
+        if self.codec.name == "json":
+            return payload
+        return _CODEC_MAGIC + self.codec.name.encode("ascii") + b"\n" + payload
+
+    def _decode(self, raw: bytes) -> Dict[str, Any]:
+        if not raw.startswith(_CODEC_MAGIC):
+            return CODECS["json"].decode(raw)  # legacy / default format
+        header, _, payload = raw.partition(b"\n")
+        name = header[len(_CODEC_MAGIC):].decode("ascii")
+        if name == self.codec.name:
+            return self.codec.decode(payload)
+        codec = CODECS[name]
+        # never unpickle a file this cache did not opt into: it could run arbitrary code
+        if not codec.safe:
+            raise ValueError(f"refusing to read {name!r} data with the {self.codec.name!r} codec")
+        return codec.decode(payload)
 
     def _load(self) -> None:
-        with _LOCK:
+        if self.interprocess:
+            self._refresh()
+            return
+        with self._lock:
             if self._loaded:
                 return
-            if not self.path.exists():
-                self._data = {}
-                self._loaded = True
-                return
-            try:
-                raw = self.path.read_text(encoding="utf-8")
-                obj = json.loads(raw) if raw else {}
-                # validate shape
-                if isinstance(obj, dict):
-                    self._data = obj
-                else:
-                    self._data = {}
-            except Exception:
-                # corrupted -> reset
-                self._data = {}
+            m = self._metrics
+            t0 = time.perf_counter() if m else 0.0
+            raw, obj = self._read_file()
+            self._replace_locked(obj)
+            if self.storage == "journal":
+                self._snapshot_bytes = len(raw)
+                # a log left behind by an interrupted compaction predates the current one
+                self._replay_log_locked(self._log_path.with_name(self._log_path.name + ".1"))
+                self._log_bytes = self._replay_log_locked(self._log_path)
             self._loaded = True
             self._prune_expired_locked()
+            if m:
+                m.load.add(time.perf_counter() - t0)
 
     def _save(self) -> None:
-        with _LOCK:
+        m = self._metrics
+        if m is None:
+            self._persist()
+            return
+        t0 = time.perf_counter()
+        self._persist()
+        m.save.add(time.perf_counter() - t0)
+
+    def _persist(self) -> None:
+        if self.interprocess:
+            self._save_shared()
+            return
+        with self._lock:
             self._prune_expired_locked()
-            s = json.dumps(self._data, ensure_ascii=False, indent=2, default=str)
-            self._atomic_write(s)
+            if self.storage == "journal":
+                self._append_journal_locked()
+                self._dirty = 0
+                self._saved_mutations = self._mutations
+                return
+            # entries are replaced, never mutated, so a shallow copy is a stable snapshot
+            snapshot = dict(self._data)
+            self._save_gen += 1
+            gen = self._save_gen
+            seq = self._mutations
+        # serialize outside the cache lock so readers and writers are not blocked
+        s = self._encode(snapshot)
+        with self._io_lock:
+            # a newer snapshot may already have been written by another thread
+            if gen > self._written_gen:
+                self._atomic_write(s)
+                self._written_gen = gen
+        # only a write that landed marks mutations as saved, so a failed one is retried by
+        # the next flush() and overlapping saves never count a later mutation as written
+        with self._lock:
+            self._saved_mutations = max(self._saved_mutations, seq)
+            self._dirty = self._mutations - self._saved_mutations
+
+    # interprocess mode ---------------------------------------------------
+
+    def _stat_sig(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _refresh(self) -> None:
+        """Merge the cache file if another process replaced it since we last looked."""
+        sig = self._stat_sig()
+        with self._lock:
+            if self._loaded and sig == self._disk_sig:
+                return
+            m = self._metrics
+            t0 = time.perf_counter() if m else 0.0
+            _, disk = self._read_file()
+            if self._loaded:
+                self._merge_locked(disk)
+            else:
+                self._replace_locked(disk)
+                self._loaded = True
+            self._disk_sig = sig
+            self._prune_expired_locked()
+            if m:
+                m.load.add(time.perf_counter() - t0)
+
+    def _merge_locked(self, disk: Dict[str, Any]) -> None:
+        """Per-key merge: the newer "updated" wins, unwritten local changes are kept."""
+        for key, entry in disk.items():
+            if not isinstance(entry, dict):
+                continue
+            updated = entry.get("updated") or 0
+            if updated <= self._cleared_at or self._tombstones.get(key, -1.0) >= updated:
+                continue
+            local = self._data.get(key)
+            local_updated = None if local is None else (local.get("updated") or 0)
+            # on a timestamp tie the file wins unless the local copy is an unwritten change
+            if local_updated is None or updated > local_updated or (
+                updated == local_updated and key not in self._touched
+            ):
+                self._put_locked(key, entry)
+        # keys we hold that are gone from disk were deleted elsewhere, unless we added them
+        for key in [k for k in self._data if k not in disk and k not in self._touched]:
+            self._drop_locked(key)
+
+    def _save_shared(self) -> None:
+        with self._lock, FileLock(self._lock_path):
+            self._refresh()
+            self._atomic_write(self._encode(self._data))
+            # cleared only once written, so a failed write is retried by the next flush()
+            self._dirty = 0
+            self._saved_mutations = self._mutations
+            self._disk_sig = self._stat_sig()
+            self._touched.clear()
+            self._tombstones.clear()
+            self._cleared_at = 0.0
+
+    # journal storage -----------------------------------------------------
+
+    def _record_locked(self, op: str, key: Optional[str] = None, entry: Optional[Dict[str, Any]] = None) -> None:
+        """Note a mutation for the journal and for interprocess merging."""
+        if self.interprocess:
+            if op == "set":
+                self._touched[key] = time.time()
+                self._tombstones.pop(key, None)
+            elif op == "del":
+                self._touched.pop(key, None)
+                self._tombstones[key] = time.time()
+            elif op == "clear":
+                self._touched.clear()
+                self._tombstones.clear()
+                self._cleared_at = time.time()
+        if self.storage != "journal":
+            return
+        rec: Dict[str, Any] = {"op": op}
+        if key is not None:
+            rec["k"] = key
+        if entry is not None:
+            rec["e"] = entry
+        if self.codec.name == "json":
+            line = json.dumps(rec, ensure_ascii=False, separators=(",", ":"), default=str)
+            self._journal.append(line.encode("utf-8") + b"\n")
+        else:
+            # other codecs keep what they can store (tuples, dates, ...) in the log as well
+            payload = self.codec.encode(rec)
+            self._journal.append(_RECORD_MAGIC + struct.pack(">I", len(payload)) + payload)
+
+    def _replay_log_locked(self, log: Path) -> int:
+        """Apply the records in log on top of the loaded data; return the log's valid size."""
+        try:
+            raw = log.read_bytes()
+        except FileNotFoundError:
+            return 0
+        good = 0
+        while good < len(raw):
+            try:
+                if raw[good:good + 1] == _RECORD_MAGIC:
+                    start = good + 1 + 4
+                    if start > len(raw):
+                        break  # torn tail
+                    end = start + struct.unpack(">I", raw[good + 1:start])[0]
+                    if end > len(raw):
+                        break
+                    rec = self.codec.decode(raw[start:end])
+                else:
+                    end = raw.find(b"\n", good) + 1
+                    if not end:
+                        break  # torn tail
+                    rec = json.loads(raw[good:end])
+                op = rec["op"]
+                if op == "set":
+                    self._put_locked(rec["k"], rec["e"])
+                elif op == "del":
+                    self._drop_locked(rec["k"])
+                elif op == "clear":
+                    self._replace_locked({})
+            except Exception:
+                break
+            good = end
+        if good < len(raw):
+            logging.warning("Dropping %d damaged trailing bytes from %s", len(raw) - good, log)
+            with open(log, "r+b") as f:
+                f.truncate(good)
+        return good
+
+    def _append_journal_locked(self) -> None:
+        if not self._journal:
+            return
+        data = b"".join(self._journal)
+        self._log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._log_path, "ab") as f:
+            f.write(data)
+        if self._metrics:
+            self._metrics.bytes_written += len(data)
+        self._journal = []
+        self._log_bytes += len(data)
+        limit = max(_COMPACT_MIN_BYTES, self.compact_ratio * self._snapshot_bytes)
+        if self._log_bytes > limit and not self._compacting:
+            self._compacting = True
+            Thread(target=self._compact_in_background, name="SimpleCache-compact", daemon=True).start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            logging.exception("Compacting %s failed", self._log_path)
+
+    def compact(self) -> None:
+        """Fold the journal into a fresh snapshot (journal storage only)."""
+        if self.storage != "journal":
+            return
+        self._load()
+        rotated = self._log_path.with_name(self._log_path.name + ".1")
+        with self._compact_lock:
+            with self._lock:
+                self._compacting = True
+                self._prune_expired_locked()
+                self._append_journal_locked()
+                data = dict(self._data)
+                # records appended from here on go to a fresh log
+                if self._log_path.exists():
+                    if rotated.exists():
+                        # left by an interrupted compaction and not yet in a snapshot:
+                        # keep its (older) records ahead of the live ones
+                        with open(rotated, "ab") as dst, open(self._log_path, "rb") as src:
+                            shutil.copyfileobj(src, dst)
+                        os.remove(str(self._log_path))
+                    else:
+                        os.replace(str(self._log_path), str(rotated))
+                self._log_bytes = 0
+            try:
+                snapshot = self._encode(data)
+                self._atomic_write(snapshot)
+                with self._lock:
+                    self._snapshot_bytes = len(snapshot)
+                if rotated.exists():
+                    rotated.unlink()
+            finally:
+                self._compacting = False
+
+    def _changed_locked(self) -> bool:
+        """
+        Record a mutation. Returns True when the caller must _save() once it has
+        released the lock (synchronous mode); otherwise the flusher persists it.
+        """
+        self._dirty += 1
+        self._mutations += 1
+        if not self.write_behind or self._closed:
+            return True
+        if self._flusher is None:
+            self._flusher = Thread(target=self._flush_loop, name="SimpleCache-flusher", daemon=True)
+            self._flusher.start()
+        if self.flush_after and self._dirty >= self.flush_after:
+            self._wake.set()
+        return False
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Background flush of %s failed", self.path)
+
+    def flush(self) -> None:
+        """Write pending mutations to disk (no-op when nothing changed)."""
+        if self._dirty:
+            self._save()
+
+    def close(self) -> None:
+        """Flush pending mutations and stop the background flusher."""
+        with self._lock:
+            self._closed = True
+            flusher, self._flusher = self._flusher, None
+        self._wake.set()
+        if flusher is not None:
+            flusher.join()
+        self.flush()
+        _WRITE_BEHIND.discard(self)
+        if self.metrics_dump and not self._dump_stop.is_set():
+            self._dump_stop.set()
+            self._dump_metrics()
+
+    def _dump_loop(self) -> None:
+        while not self._dump_stop.wait(self.metrics_interval):
+            self._dump_metrics()
+
+    def _dump_metrics(self) -> None:
+        try:
+            line = json.dumps({"ts": time.time(), "path": str(self.path), **self.stats()})
+            with open(self.metrics_dump, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception:
+            logging.exception("Writing cache metrics to %s failed", self.metrics_dump)
+
+    def _replace_locked(self, content: Dict[str, Dict[str, Any]]) -> None:
+        """Replace all entries (keeping their order) and rebuild the expiry heap."""
+        self._data = OrderedDict((k, v) for k, v in content.items() if isinstance(v, dict))
+        self._expiry = [(v["expires"], k) for k, v in self._data.items() if v.get("expires")]
+        heapq.heapify(self._expiry)
+        # sizes are only needed (and only paid for) when max_bytes is set
+        self._sizes = {k: self._entry_size(k, v) for k, v in self._data.items()} if self.max_bytes else {}
+        self._bytes = sum(self._sizes.values())
+
+    @staticmethod
+    def _entry_size(key: str, entry: Dict[str, Any]) -> int:
+        try:
+            value = json.dumps(entry.get("value"), ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+        except (TypeError, ValueError):
+            # e.g. tuple dict keys kept by the pickle/marshal codecs
+            value = pickle.dumps(entry.get("value"), protocol=pickle.DEFAULT_PROTOCOL)
+        return len(key.encode("utf-8")) + len(value) + _ENTRY_OVERHEAD
+
+    def _put_locked(self, key: str, entry: Dict[str, Any]) -> None:
+        if self.max_bytes:
+            size = self._entry_size(key, entry)
+            self._bytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        if entry.get("expires"):
+            heapq.heappush(self._expiry, (entry["expires"], key))
+
+    def _drop_locked(self, key: str) -> None:
+        if self._data.pop(key, _MISSING) is not _MISSING:
+            self._bytes -= self._sizes.pop(key, 0)
 
     def _prune_expired_locked(self) -> None:
         now = time.time()
-        keys_to_delete = [k for k, v in self._data.items() if v.get("expires") and v["expires"] <= now]
-        for k in keys_to_delete:
-            self._data.pop(k, None)
-        # enforce max_entries by updated timestamp (oldest removed)
-        if self.max_entries and len(self._data) > self.max_entries:
-            items = sorted(self._data.items(), key=lambda kv: kv[1].get("updated", 0))
-            for k, _ in items[: len(self._data) - self.max_entries]:
-                self._data.pop(k, None)
+        heap = self._expiry
+        while heap and heap[0][0] <= now:
+            expires, key = heapq.heappop(heap)
+            item = self._data.get(key)
+            # skip heap entries left behind by an overwrite or delete
+            if item is not None and item.get("expires") == expires:
+                self._drop_locked(key)
+                if self._metrics:
+                    self._metrics.expirations += 1
+        # enforce max_entries / max_bytes by recency (least recently used removed)
+        while self._data and (
+            (self.max_entries and len(self._data) > self.max_entries)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._data))
+            self._drop_locked(key)
+            self._record_locked("del", key)
+            if self._metrics:
+                self._metrics.evictions += 1
+        # keep stale heap entries from piling up when keys are rewritten often
+        if len(heap) > 2 * len(self._data) + 64:
+            self._expiry = [(v["expires"], k) for k, v in self._data.items() if v.get("expires")]
+            heapq.heapify(self._expiry)
 
-    def get(self, key: str, default: Any = None) -> Any:
+    def _lookup(self, key: str) -> Tuple[Any, bool]:
+        """Return (value or _MISSING, stale) for key, dropping it once it has expired."""
         self._load()
-        with _LOCK:
+        m = self._metrics
+        with self._lock:
             item = self._data.get(key)
             if not item:
-                return default
+                if m:
+                    m.misses += 1
+                return _MISSING, False
+            now = time.time()
             expires = item.get("expires")
-            if expires and expires <= time.time():
-                # expired
-                self._data.pop(key, None)
-                self._save()
-                return default
-            return item.get("value", default)
+            if not expires or expires > now:
+                self._data.move_to_end(key)
+                if m:
+                    m.hits += 1
+                fresh = item.get("fresh")
+                return item.get("value", _MISSING), bool(fresh and fresh <= now)
+            # expired
+            if m:
+                m.misses += 1
+                m.expirations += 1
+            self._drop_locked(key)
+            self._record_locked("del", key)
+            save = self._changed_locked()
+        if save:
+            self._save()
+        return _MISSING, False
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value, stale = self._lookup(key)
+        return default if value is _MISSING or stale else value
 
     def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
         """
         Set key to value. ttl in seconds (optional).
         """
+        self._store(key, value, ttl)
+
+    def _store(self, key: str, value: Any, ttl: Optional[float], stale_ttl: Optional[float] = None) -> None:
         self._load()
-        with _LOCK:
-            expires = time.time() + ttl if ttl else None
-            self._data[key] = {"value": value, "expires": expires, "updated": time.time()}
+        with self._lock:
+            now = time.time()
+            expires = now + ttl if ttl else None
+            entry = {"value": value, "expires": expires, "updated": now}
+            if expires and stale_ttl:
+                # served (as stale) by get_or_compute for another stale_ttl seconds
+                entry["fresh"] = expires
+                entry["expires"] = expires + stale_ttl
+            self._put_locked(key, entry)
+            self._record_locked("set", key, entry)
             self._prune_expired_locked()
+            save = self._changed_locked()
+        if save:
             self._save()
 
     def delete(self, key: str) -> bool:
         self._load()
-        with _LOCK:
-            if key in self._data:
-                self._data.pop(key, None)
-                self._save()
-                return True
-            return False
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._drop_locked(key)
+            self._record_locked("del", key)
+            save = self._changed_locked()
+        if save:
+            self._save()
+        return True
 
     def clear(self) -> None:
-        with _LOCK:
-            self._data = {}
+        with self._lock:
+            self._replace_locked({})
+            self._loaded = True
+            self._record_locked("clear")
+            save = self._changed_locked()
+        if save:
             self._save()
 
     def keys(self) -> List[str]:
         self._load()
-        with _LOCK:
+        with self._lock:
             self._prune_expired_locked()
             return list(self._data.keys())
 
     def size(self) -> int:
         self._load()
-        with _LOCK:
+        with self._lock:
             self._prune_expired_locked()
             return len(self._data)
 
-    def get_or_compute(self, key: str, fn: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+    def stats(self) -> Dict[str, Any]:
+        """Entry count, approximate serialized bytes, configured limits and on-disk size."""
+        self._load()
+        with self._lock:
+            self._prune_expired_locked()
+            out = {
+                "entries": len(self._data),
+                "bytes": self._bytes if self.max_bytes else None,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+            if self._metrics:
+                out["metrics"] = self._metrics.snapshot()
+        out["file_bytes"] = sum(p.stat().st_size for p in (self.path, self._log_path) if p.exists())
+        return out
+
+    def get_or_compute(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        ttl: Optional[float] = None,
+        negative_ttl: Optional[float] = None,
+        stale_ttl: Optional[float] = None,
+    ) -> Any:
         """
         Return cached value or compute via fn(), store it with optional ttl, and return it.
-        fn is only called when value is missing/expired.
+        fn is only called when value is missing/expired, and only by one caller per
+        key at a time; a cached None counts as a hit.
+
+        negative_ttl: if fn raises, raise that error again (a fresh copy chained to
+        the original) for that many seconds instead of calling fn again (kept in
+        memory only).
+        stale_ttl: once ttl has passed, keep returning the old value for up to
+        stale_ttl more seconds while a single background thread recomputes it.
+        """
+        with self._lock:
+            neg = self._negative.get(key)
+            if neg and neg[0] <= time.time():
+                del self._negative[key]
+                neg = None
+        value, stale = self._lookup(key)
+        if value is not _MISSING and not stale:
+            return value
+        if neg:
+            if value is not _MISSING:
+                return value  # refresh failed recently: keep serving the stale value
+            raise _fresh_error(neg[1]) from neg[1]
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                # a leader may have landed between our lookup and now: use its result
+                item = self._data.get(key)
+                now = time.time()
+                if item and (not item.get("expires") or item["expires"] > now) and (
+                    not item.get("fresh") or item["fresh"] > now
+                ):
+                    return item.get("value")
+                neg = self._negative.get(key)
+                if neg and neg[0] > now:
+                    if value is not _MISSING:
+                        return value
+                    raise _fresh_error(neg[1]) from neg[1]
+                flight = self._inflight[key] = _Flight()
+        if value is not _MISSING:
+            if leader:
+                Thread(
+                    target=self._compute,
+                    args=(key, fn, flight, ttl, negative_ttl, stale_ttl),
+                    name="SimpleCache-refresh",
+                    daemon=True,
+                ).start()
+            return value
+        if leader:
+            self._compute(key, fn, flight, ttl, negative_ttl, stale_ttl)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise _fresh_error(flight.error) from flight.error
+        return flight.value
+
+    def _compute(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        flight: "_Flight",
+        ttl: Optional[float],
+        negative_ttl: Optional[float],
+        stale_ttl: Optional[float],
+    ) -> None:
+        if self._metrics:
+            self._metrics.computes += 1
+        try:
+            flight.value = fn()
+            self._store(key, flight.value, ttl, stale_ttl)
+        except Exception as exc:
+            flight.error = exc
+            if negative_ttl:
+                with self._lock:
+                    self._negative[key] = (time.time() + negative_ttl, exc)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+
+class ShardedCache:
+    """
+    SimpleCache split into `shards` independent segments.
+
+    Keys are hashed (crc32, stable across processes) onto segments that each
+    have their own lock, dirty state, LRU order and file
+    ("<stem>.shard<i><suffix>"), so threads working on different shards do not
+    contend and a write only re-serializes its own segment. max_entries is a
+    total spread evenly over the shards, as is max_bytes; other keyword
+    arguments are passed through to every SimpleCache segment.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        shards: int = 8,
+        max_entries: int = 500,
+        max_bytes: Optional[int] = None,
+        **kwargs: Any,
+    ):
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self.path = Path(path) if path else DEFAULT_CACHE_FILE
+        per_shard = -(-max_entries // shards) if max_entries else max_entries
+        bytes_per_shard = -(-max_bytes // shards) if max_bytes else max_bytes
+        self._shards = [
+            SimpleCache(
+                path=self.path.with_name(f"{self.path.stem}.shard{i}{self.path.suffix}"),
+                max_entries=per_shard,
+                max_bytes=bytes_per_shard,
+                **kwargs,
+            )
+            for i in range(shards)
+        ]
+
+    def _shard(self, key: str) -> SimpleCache:
+        return self._shards[zlib.crc32(key.encode("utf-8")) % len(self._shards)]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._shard(key).get(key, default)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._shard(key).set(key, value, ttl=ttl)
+
+    def delete(self, key: str) -> bool:
+        return self._shard(key).delete(key)
+
+    def get_or_compute(self, key: str, fn: Callable[[], Any], ttl: Optional[float] = None, **kwargs: Any) -> Any:
+        return self._shard(key).get_or_compute(key, fn, ttl=ttl, **kwargs)
+
+    def clear(self) -> None:
+        for s in self._shards:
+            s.clear()
+
+    def keys(self) -> List[str]:
+        return [k for s in self._shards for k in s.keys()]
+
+    def size(self) -> int:
+        return sum(s.size() for s in self._shards)
+
+    def stats(self) -> Dict[str, Any]:
+        """SimpleCache.stats() summed over all shards (limits are totals too)."""
+        out: Dict[str, Any] = {}
+        for s in self._shards:
+            _merge_stats(out, s.stats())
+        out["shards"] = len(self._shards)
+        return out
+
+    def flush(self) -> None:
+        for s in self._shards:
+            s.flush()
+
+    def compact(self) -> None:
+        for s in self._shards:
+            s.compact()
+
+    def close(self) -> None:
+        for s in self._shards:
+            s.close()
+
+
+class AsyncCache:
+    """
+    asyncio facade over a SimpleCache or ShardedCache.
+
+    Calls that may read or write the cache file run in an executor so the
+    event loop never blocks on disk I/O; a loaded write-behind SimpleCache is
+    served directly since its operations stay in memory (not with journal
+    storage, which appends to the log under the cache lock). A plain fn passed
+    to aget_or_compute() runs in the executor too. Concurrent aget_or_compute()
+    calls for the same key share one computation. Use one AsyncCache per event
+    loop.
+    """
+
+    def __init__(self, cache: Any = None, executor: Any = None):
+        self.cache = cache if cache is not None else _default_cache
+        self.executor = executor
+        self._inflight: Dict[str, "asyncio.Future[Any]"] = {}  # key -> compute task
+
+    def _in_memory(self) -> bool:
+        c = self.cache
+        # journal storage holds the cache lock while appending to and rotating the log,
+        # so a direct call could block the loop on that disk I/O
+        return (isinstance(c, SimpleCache) and c._loaded and c.write_behind and c.storage == "json"
+                and not c.interprocess and not c._closed)
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._in_memory():
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        return await self._run(self.cache.get, key, default)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self._run(self.cache.set, key, value, ttl)
+
+    async def adelete(self, key: str) -> bool:
+        return await self._run(self.cache.delete, key)
+
+    async def aflush(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.cache.flush)
+
+    async def aget_or_compute(self, key: str, fn: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """
+        Return the cached value or compute it with fn (a plain callable or one
+        returning an awaitable), store it with optional ttl and return it.
         """
-        val = self.get(key, None)
-        if val is not None:
-            return val
-        # compute and store
-        result = fn()
-        self.set(key, result, ttl=ttl)
-        return result
-
-# module-level convenience instance
+        task = self._inflight.get(key)
+        if task is None:
+            # the computation is its own task, so cancelling any one caller
+            # (e.g. a wait_for timeout) leaves it running for the others
+            task = self._inflight[key] = asyncio.ensure_future(self._compute(key, fn, ttl))
+            task.add_done_callback(functools.partial(self._landed, key))
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str, fn: Callable[[], Any], ttl: Optional[float]) -> Any:
+        value = await self._run(self.cache.get, key, _MISSING)
+        if value is _MISSING:
+            if inspect.iscoroutinefunction(fn):
+                value = await fn()
+            else:
+                # a plain callable may block (disk, network): keep it off the loop
+                loop = asyncio.get_running_loop()
+                value = await loop.run_in_executor(self.executor, fn)
+                if inspect.isawaitable(value):
+                    value = await value
+            await self._run(self.cache.set, key, value, ttl)
+        return value
+
+    def _landed(self, key: str, task: "asyncio.Future[Any]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here, so a failure nobody awaited any more is not reported
+
+
+def _merge_stats(into: Dict[str, Any], other: Dict[str, Any]) -> None:
+    """Add the numbers in other to into (recursively; "max_ms" takes the maximum)."""
+    for k, v in other.items():
+        if isinstance(v, dict):
+            _merge_stats(into.setdefault(k, {}), v)
+        elif v is None or k not in into:
+            into[k] = v
+        elif into[k] is not None:
+            into[k] = max(into[k], v) if k == "max_ms" else into[k] + v
+
+
+def _flush_all() -> None:
+    for c in list(_WRITE_BEHIND):
+        try:
+            c.flush()
+        except Exception:
+            logging.exception("Final flush of %s failed", c.path)
+
+
+atexit.register(_flush_all)
+
+# module-level convenience instances
 _default_cache = SimpleCache()
+_default_async = AsyncCache(_default_cache)
 
 def load_cache() -> Dict[str, Any]:
     """Return raw cache dict (internal structure)."""
@@ -144,10 +1111,17 @@ def load_cache() -> Dict[str, Any]:
 
 def save_cache(content: Dict[str, Any]) -> None:
     """Overwrite cache with provided raw dict (must follow internal structure)."""
-    with _LOCK:
-        _default_cache._data = content or {}
+    with _default_cache._lock:
+        _default_cache._replace_locked(content or {})
+        _default_cache._loaded = True
         _default_cache._save()
 
+def flush() -> None:
+    _default_cache.flush()
+
+def stats() -> Dict[str, Any]:
+    return _default_cache.stats()
+
 def get(key: str, default: Any = None) -> Any:
     return _default_cache.get(key, default)
 
@@ -166,5 +1140,17 @@ def keys() -> List[str]:
 def size() -> int:
     return _default_cache.size()
 
-def get_or_compute(key: str, fn: Callable[[], Any], ttl: Optional[float] = None) -> Any:
-    return _default_cache.get_or_compute(key, fn, ttl=ttl)
+def get_or_compute(key: str, fn: Callable[[], Any], ttl: Optional[float] = None, **kwargs: Any) -> Any:
+    return _default_cache.get_or_compute(key, fn, ttl=ttl, **kwargs)
+
+async def aget(key: str, default: Any = None) -> Any:
+    return await _default_async.aget(key, default)
+
+async def aset(key: str, value: Any, ttl: Optional[float] = None) -> None:
+    await _default_async.aset(key, value, ttl=ttl)
+
+async def aget_or_compute(key: str, fn: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+    return await _default_async.aget_or_compute(key, fn, ttl=ttl)
+
+async def aflush() -> None:
+    await _default_async.aflush()
@@ -3,6 +3,7 @@ from tkinter import ttk, messagebox, simpledialog, filedialog
 from tkinter.scrolledtext import ScrolledText
 from pathlib import Path
 from typing import Dict, Any, Optional
+import logging
 import threading
 import time
 from datetime import datetime
@@ -83,13 +84,32 @@ class PythonNewGUI(tk.Tk):
         self._create_widgets()
         self._bind_shortcuts()
         self.templates_dir = Path(__file__).with_name("templates")
-        self.tm = TemplatesManager(self.templates_dir)
+        # a packed templates.zip next to the app is the read-only base, templates/ the overlay
+        bundle = Path(__file__).with_name("templates.zip")
+        # no I/O here beyond that check; metadata, listing and seeding happen on the loader thread
+        self.tm = TemplatesManager(self.templates_dir, lazy=True, bundle=bundle if bundle.exists() else None)
+        # GUI state (last template/target/file) is persisted debounced, off the Tk thread
+        self._state_writer = registry.RegistryWriter()
         self._load_templates_async()
         # restore last template selection from registry if present
         last = registry.get("last_template")
         if last:
             self._select_template_by_name(last)
 
+    def destroy(self):
+        # write pending GUI state before the window goes away
+        writer = getattr(self, "_state_writer", None)
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                logging.exception("Failed to persist GUI state on close")
+        # unmap templates.zip so it can be re-packed while the app is closed
+        tm = getattr(self, "tm", None)
+        if tm is not None:
+            tm.close()
+        super().destroy()
+
     def _setup_style(self):
         style = ttk.Style(self)
         try:
@@ -265,7 +285,11 @@ class PythonNewGUI(tk.Tk):
         self.bind("<Delete>", lambda e: self._delete_template())
 
     def _load_templates_async(self):
-        threading.Thread(target=self._load_templates, daemon=True).start()
+        threading.Thread(target=self._initial_load, daemon=True).start()
+
+    def _initial_load(self):
+        self.tm.ensure_default_templates()
+        self._load_templates()
 
     def _load_templates(self):
         names = self.tm.list_templates()
@@ -284,7 +308,7 @@ class PythonNewGUI(tk.Tk):
             self._update_button_states()
             return
         name = self.tpl_list.get(sel[0])
-        registry.set("last_template", name)
+        self._state_writer.post({"last_template": name})
         self._show_template(name)
         self._update_button_states()
 
@@ -309,13 +333,13 @@ class PythonNewGUI(tk.Tk):
             pass
 
     def _show_template(self, name: str):
-        content, meta = self.tm.load_template(name, with_meta=True)
+        content = self.tm.load_template(name)
         self.tpl_label.config(text=name)
         self.preview.delete("1.0", "end")
         self.preview.insert("1.0", content)
-        # show vars according to metadata
+        # show a row per placeholder actually used by the template
         self._clear_vars()
-        vars_list = meta.get("vars") or []
+        vars_list = self.tm.template_vars(name)
         for k in vars_list:
             self._add_var_row(k, "")
         # always show a blank var row
@@ -330,7 +354,12 @@ class PythonNewGUI(tk.Tk):
             return
         # collect vars
         vars_dict = self._collect_vars()
-        out = self.tm.render_template(name, vars_dict)
+        try:
+            out = self.tm.render_template(name, vars_dict)
+        except (ValueError, FileNotFoundError) as e:
+            # variable or include cycles (TemplateCycleError), missing includes, bad directives
+            messagebox.showerror(APP_TITLE, f"Cannot render {name}:\n{e}")
+            return
         self.preview.delete("1.0", "end")
         self.preview.insert("1.0", out)
         self._highlight_current_line()
@@ -512,12 +541,12 @@ class PythonNewGUI(tk.Tk):
         self._highlight_current_line()
 
     def _auto_fill_vars(self):
-        """Populate variable rows with sensible sample values (from metadata vars or simple heuristics)."""
+        """Populate variable rows with sensible sample values (for the template's placeholders, by simple heuristics)."""
         name = self._current_template_name()
         if not name:
             return
         meta = self.tm.get_metadata(name) or {}
-        vars_list = meta.get("vars") or []
+        vars_list = self.tm.template_vars(name)
         # simple heuristics for sample values
         samples = {}
         for k in vars_list:
@@ -554,8 +583,7 @@ class PythonNewGUI(tk.Tk):
             "Vim: Toggle with 'Vim' button. In Normal mode use h/j/k/l, i to insert, x to delete char, dd to delete line, yy to yank, p to paste.\n"
         )
         if name:
-            meta = self.tm.get_metadata(name) or {}
-            vars_list = meta.get("vars") or []
+            vars_list = self.tm.template_vars(name)
             if vars_list:
                 text += "\nDetected variable keys: " + ", ".join(vars_list) + "\n"
             # show a sample render using auto-filled values (don't modify user entries)
@@ -571,8 +599,13 @@ class PythonNewGUI(tk.Tk):
                     samples[k] = datetime.utcnow().date().isoformat()
                 else:
                     samples[k] = f"<{k}>"
-            rendered = self.tm.render_template(name, samples)
-            text += "\n--- Example render ---\n\n" + rendered
+            try:
+                rendered = self.tm.render_template(name, samples)
+            except (ValueError, FileNotFoundError) as e:
+                # same failures as _render_preview: cycles, missing includes, bad directives
+                text += f"\n--- Example render ---\n\nCannot render {name}:\n{e}\n"
+            else:
+                text += "\n--- Example render ---\n\n" + rendered
         messagebox.showinfo(f"{APP_TITLE} — Template variables", text)
 
     def _current_template_name(self) -> Optional[str]:
@@ -647,7 +680,7 @@ class PythonNewGUI(tk.Tk):
         if chosen:
             self.target_dir = Path(chosen)
             self.status.config(text=f"Target: {self.target_dir}")
-            registry.update_registry({"last_target": str(self.target_dir)})
+            self._state_writer.post({"last_target": str(self.target_dir)})
 
     def _create_file(self):
         name = self._current_template_name()
@@ -666,7 +699,7 @@ class PythonNewGUI(tk.Tk):
             dest.parent.mkdir(parents=True, exist_ok=True)
             dest.write_text(content, encoding="utf-8")
             messagebox.showinfo(APP_TITLE, f"Created {dest}")
-            registry.update_registry({"last_created": str(dest)})
+            self._state_writer.post({"last_created": str(dest)})
         except Exception as e:
             messagebox.showerror(APP_TITLE, f"Cannot create file:\n{e}")
 
@@ -0,0 +1,94 @@
+import errno
+import os
+import time
+from pathlib import Path
+from typing import IO, Optional, Union
+
+# errnos msvcrt.locking raises while another process holds the lock
+_LOCK_BUSY = {getattr(errno, "EDEADLOCK", errno.EDEADLK), errno.EACCES}
+
+
+class FileLock:
+    """
+    Advisory, exclusive inter-process lock held on a side file.
+
+    Uses fcntl.flock on POSIX and msvcrt.locking on Windows. Only processes
+    that also take the lock are coordinated; the lock file itself stays empty.
+
+        with FileLock(path + ".lock"):
+            ...read-modify-write path...
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = str(path)
+        self._fh: Optional[IO[bytes]] = None
+
+    def acquire(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fh = open(self.path, "a+b")
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                fh.seek(0)
+                while True:
+                    try:
+                        # LK_LOCK retries for ~10 seconds before raising
+                        msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError as exc:
+                        # only "still locked by someone else" is worth waiting for
+                        if exc.errno not in _LOCK_BUSY:
+                            raise
+                        time.sleep(0.05)
+            else:
+                import fcntl
+
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            fh.close()
+            raise
+        self._fh = fh
+
+    def release(self) -> None:
+        fh, self._fh = self._fh, None
+        if fh is None:
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+        finally:
+            fh.close()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def replace_file(src: Union[str, Path], dst: Union[str, Path], attempts: int = 8, delay: float = 0.01) -> None:
+    """
+    os.replace(src, dst), retried with exponential backoff on PermissionError.
+
+    On Windows replacing a file that another handle has open (a reader in
+    this or another process parsing it without the lock) fails with a
+    sharing violation. Readers only hold the file briefly, so waiting
+    (about 1.3 s in total by default) gets the write through.
+    """
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay * 2 ** attempt)
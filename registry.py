@@ -1,19 +1,33 @@
+import copy
 import os
 import sys
 import json
 import logging
 import shutil
-from typing import Any, Dict, Optional, Tuple
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from locking import FileLock, replace_file
 
 __all__ = [
     "registry_path",
     "load_registry",
     "save_registry",
     "update_registry",
+    "transaction",
+    "RegistryWriter",
     "get",
     "set",
     "delete",
     "get_python_new_path",
+    "WinregSession",
+    "desired_shell_state",
+    "plan_shell_state",
+    "apply_shell_state",
+    "shell_status",
     "check_entry_background",
     "create_entry_background",
     "remove_entry_background",
@@ -32,28 +46,156 @@ def registry_path(path: Optional[str] = None) -> str:
     return os.path.join(os.path.dirname(__file__), "registry.json")
 
 
-def load_registry(path: Optional[str] = None) -> Dict[str, Any]:
-    """Load registry (JSON). Returns empty dict if file missing or unreadable."""
-    p = registry_path(path)
-    if not os.path.exists(p):
+# fsync registry writes (file and, on POSIX, its directory) before returning
+FSYNC = False
+
+# Process-wide parsed registry files: path -> ((mtime_ns, size, inode), data). A cached
+# dict is never handed out or mutated in place; it is revalidated with one os.stat.
+_cache: Dict[str, Tuple[Tuple[int, int, int], Dict[str, Any]]] = {}
+_cache_lock = threading.Lock()
+
+
+def _stat_sig(p: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(p)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _read(p: str) -> Dict[str, Any]:
+    """Parsed registry at p, re-read only when the file changed. Callers must not mutate it."""
+    sig = _stat_sig(p)
+    if sig is None:
+        with _cache_lock:
+            _cache.pop(p, None)
         return {}
+    with _cache_lock:
+        hit = _cache.get(p)
+    if hit is not None and hit[0] == sig:
+        return hit[1]
     try:
         with open(p, "r", encoding="utf-8") as f:
-            return json.load(f) or {}
+            data = json.load(f) or {}
     except (json.JSONDecodeError, OSError):
         logging.exception("Failed to read registry file; returning empty dict.")
         return {}
+    with _cache_lock:
+        _cache[p] = (sig, data)
+    return data
+
+
+def _lock(p: str) -> FileLock:
+    """Advisory lock serializing read-modify-write cycles on p across processes."""
+    return FileLock(p + ".lock")
+
+
+def _write(p: str, data: Dict[str, Any]) -> None:
+    """Atomically write data (which the cache then owns) to p."""
+    # unique per writer, so concurrent writers never share a half-written temp file
+    tmp = f"{p}.{uuid.uuid4().hex[:8]}.tmp"
+    os.makedirs(os.path.dirname(p), exist_ok=True)
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            if FSYNC:
+                os.fsync(f.fileno())
+            # the signature of what we wrote; os.replace keeps mtime, size and inode, and a
+            # concurrent writer replacing p right after us still shows up as a different file
+            st = os.fstat(f.fileno())
+        # atomic replace; retried while a lock-free reader has p open (Windows)
+        replace_file(tmp, p)
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+    if FSYNC and os.name != "nt":
+        fd = os.open(os.path.dirname(p), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    with _cache_lock:
+        _cache[p] = ((st.st_mtime_ns, st.st_size, st.st_ino), data)
+
+
+_MISSING = object()
+
+# Open transactions of the current thread: path -> [snapshot, nesting depth]
+_local = threading.local()
+
+
+def _open_transaction(p: str) -> Optional[Dict[str, Any]]:
+    """The snapshot of this thread's open transaction on p, if any."""
+    tx = getattr(_local, "transactions", {}).get(p)
+    return tx[0] if tx else None
+
+
+@contextmanager
+def transaction(path: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Load the registry once and yield it as a dict snapshot. Changes to the
+    snapshot, and get/set/delete/update_registry/load_registry/save_registry
+    calls for the same path in this thread, apply to it; leaving the
+    outermost block writes it back in one atomic write, or not at all when
+    nothing changed or the block raised. Nested transactions on the same path
+    share the outer snapshot. The commit applies the keys the block set or
+    deleted to the file as it is then (under the registry lock), so other
+    processes' changes to other keys made meanwhile are kept.
+
+        with registry.transaction() as reg:
+            reg["last_target"] = str(target)
+            registry.set("last_template", name)
+    """
+    p = registry_path(path)
+    transactions = _local.__dict__.setdefault("transactions", {})
+    tx = transactions.get(p)
+    if tx is not None:
+        tx[1] += 1
+        try:
+            yield tx[0]
+        finally:
+            tx[1] -= 1
+        return
+    base = _read(p)
+    snapshot = copy.deepcopy(base)
+    transactions[p] = [snapshot, 1]
+    try:
+        yield snapshot
+    finally:
+        del transactions[p]
+    changed = {k: v for k, v in snapshot.items() if k not in base or base[k] != v}
+    deleted = [k for k in base if k not in snapshot]
+    if not changed and not deleted:
+        return
+    with _lock(p):
+        reg = dict(_read(p))
+        reg.update(changed)
+        for k in deleted:
+            reg.pop(k, None)
+        _write(p, reg)
+
+
+def load_registry(path: Optional[str] = None) -> Dict[str, Any]:
+    """Load registry (JSON). Returns empty dict if file missing or unreadable."""
+    p = registry_path(path)
+    tx = _open_transaction(p)
+    return copy.deepcopy(_read(p) if tx is None else tx)
 
 
 def save_registry(data: Dict[str, Any], path: Optional[str] = None) -> None:
     """Atomically write the registry dict to disk."""
     p = registry_path(path)
-    tmp = p + ".tmp"
-    os.makedirs(os.path.dirname(p), exist_ok=True)
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    # atomic replace
-    os.replace(tmp, p)
+    tx = _open_transaction(p)
+    if tx is not None:
+        tx.clear()
+        tx.update(copy.deepcopy(data))
+        return
+    with _lock(p):
+        _write(p, copy.deepcopy(data))
 
 
 def update_registry(updates: Dict[str, Any], path: Optional[str] = None) -> Dict[str, Any]:
@@ -63,30 +205,143 @@ def update_registry(updates: Dict[str, Any], path: Optional[str] = None) -> Dict
     """
     if not isinstance(updates, dict):
         raise TypeError("updates must be a dict")
-    reg = load_registry(path)
-    reg.update(updates)
-    save_registry(reg, path)
-    return reg
+    p = registry_path(path)
+    tx = _open_transaction(p)
+    if tx is not None:
+        tx.update(copy.deepcopy(updates))
+        return copy.deepcopy(tx)
+    with _lock(p):
+        reg = dict(_read(p))
+        reg.update(copy.deepcopy(updates))
+        _write(p, reg)
+    return copy.deepcopy(reg)
 
 
 def get(key: str, default: Any = None, path: Optional[str] = None) -> Any:
-    reg = load_registry(path)
-    return reg.get(key, default)
+    p = registry_path(path)
+    tx = _open_transaction(p)
+    reg = _read(p) if tx is None else tx
+    return copy.deepcopy(reg[key]) if key in reg else default
 
 
 def set(key: str, value: Any, path: Optional[str] = None) -> None:
-    reg = load_registry(path)
-    reg[key] = value
-    save_registry(reg, path)
+    p = registry_path(path)
+    tx = _open_transaction(p)
+    if tx is not None:
+        tx[key] = copy.deepcopy(value)
+        return
+    with _lock(p):
+        reg = dict(_read(p))
+        reg[key] = copy.deepcopy(value)
+        _write(p, reg)
 
 
 def delete(key: str, path: Optional[str] = None) -> bool:
-    reg = load_registry(path)
-    if key in reg:
+    p = registry_path(path)
+    tx = _open_transaction(p)
+    if tx is not None:
+        return tx.pop(key, _MISSING) is not _MISSING
+    with _lock(p):
+        reg = _read(p)
+        if key not in reg:
+            return False
+        reg = dict(reg)
         del reg[key]
-        save_registry(reg, path)
-        return True
-    return False
+        _write(p, reg)
+    return True
+
+
+class RegistryWriter:
+    """
+    Debounced registry persistence for UI code. post() merges updates and
+    returns at once; a background thread writes them with one
+    update_registry() call when no new update arrived for `delay` seconds,
+    so a burst of posts (e.g. arrow keys through a list) costs one write.
+    Under a steady stream of posts (a held arrow key) pending updates are
+    still written at most `max_wait` seconds after the first of them.
+    flush() writes pending updates now; close() flushes and stops the thread.
+    A failed background write is retried after `delay`, doubling per
+    consecutive failure up to MAX_BACKOFF seconds.
+    """
+
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, path: Optional[str] = None, delay: float = 0.25, max_wait: float = 1.0):
+        self.path = path
+        self.delay = delay
+        self.max_wait = max_wait
+        self._pending: Dict[str, Any] = {}
+        self._first_pending = 0.0
+        self._deadline = 0.0
+        self._retry_at = 0.0
+        self._cond = threading.Condition()
+        # serializes writes so a flush() from the caller and the thread's never reorder
+        self._io_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def post(self, updates: Dict[str, Any]) -> None:
+        if not isinstance(updates, dict):
+            raise TypeError("updates must be a dict")
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("RegistryWriter is closed")
+            now = time.monotonic()
+            if not self._pending:
+                self._first_pending = now
+            self._pending.update(copy.deepcopy(updates))
+            self._deadline = min(now + self.delay, self._first_pending + self.max_wait)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="RegistryWriter", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        failures = 0
+        while True:
+            with self._cond:
+                while not self._closed and (not self._pending
+                                            or time.monotonic() < max(self._deadline, self._retry_at)):
+                    self._cond.wait(max(self._deadline, self._retry_at) - time.monotonic()
+                                    if self._pending else None)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+                failures = 0
+            except Exception:
+                logging.exception("Failed to persist registry updates")
+                # the restored updates are already past their deadline; wait before retrying
+                backoff = min(max(self.delay, 0.01) * 2 ** failures, self.MAX_BACKOFF)
+                failures += 1
+                with self._cond:
+                    self._retry_at = time.monotonic() + backoff
+
+    def flush(self) -> None:
+        """Write pending updates now (no-op when there are none)."""
+        with self._io_lock:
+            with self._cond:
+                updates, self._pending = self._pending, {}
+            if not updates:
+                return
+            try:
+                update_registry(updates, self.path)
+            except Exception:
+                # keep them for the next attempt, behind anything posted meanwhile
+                with self._cond:
+                    for key, value in updates.items():
+                        self._pending.setdefault(key, value)
+                raise
+
+    def close(self) -> None:
+        """Stop the background thread and write what is still pending."""
+        with self._cond:
+            self._closed = True
+            thread = self._thread
+            self._cond.notify()
+        if thread is not None:
+            thread.join()
+        self.flush()
 
 
 # PythonNew script discovery ------------------------------------------------
@@ -129,75 +384,273 @@ def _get_winreg(winreg_module):
         raise RuntimeError("winreg not available on this platform") from exc
 
 
+_HIVES = {"HKCU": "HKEY_CURRENT_USER", "HKCR": "HKEY_CLASSES_ROOT"}
+_BACKGROUND_KEYS = {
+    "user": ("HKCU", r"Software\Classes\Directory\Background\shell\NeuePythonDatei"),
+    "system": ("HKCR", r"Directory\Background\shell\NeuePythonDatei"),
+}
+_SHELLNEW_KEYS = {
+    "user": ("HKCU", r"Software\Classes\.py\ShellNew"),
+    "system": ("HKCR", r".py\ShellNew"),
+}
+
+# desired state: (hive, key path) -> {value name: REG_SZ data}, or None for "key absent"
+ShellState = Dict[Tuple[str, str], Optional[Dict[str, str]]]
+
+
+class WinregSession:
+    """
+    Read-through cache over one winreg module. Key handles are opened once
+    and released by close(); value reads, misses included, are remembered
+    and kept current by set_value()/delete_key(), so planning and applying a
+    change set probes each key and value at most once.
+    """
+
+    def __init__(self, winreg_module=None):
+        self.winreg = _get_winreg(winreg_module)
+        self._handles: Dict[Tuple[str, str], Any] = {}  # None marks a missing key
+        self._writable: Dict[Tuple[str, str], Any] = {}
+        self._values: Dict[Tuple[str, str, str], Any] = {}
+
+    def __enter__(self) -> "WinregSession":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _root(self, hive: str):
+        return getattr(self.winreg, _HIVES[hive])
+
+    def open(self, hive: str, path: str):
+        """Return a read handle for the key, or None when it cannot be opened."""
+        k = (hive, path.lower())
+        if k not in self._handles:
+            try:
+                self._handles[k] = self.winreg.OpenKey(self._root(hive), path)
+            except OSError:
+                self._handles[k] = None
+        return self._handles[k]
+
+    def exists(self, hive: str, path: str) -> bool:
+        return self.open(hive, path) is not None
+
+    def query(self, hive: str, path: str, name: str) -> Any:
+        """Return the value's data, or _MISSING when the key or value is absent."""
+        k = (hive, path.lower(), name)
+        if k not in self._values:
+            value = _MISSING
+            key = self.open(hive, path)
+            if key is not None:
+                try:
+                    value = self.winreg.QueryValueEx(key, name)[0]
+                except OSError:
+                    pass
+            self._values[k] = value
+        return self._values[k]
+
+    def set_value(self, hive: str, path: str, name: str, value: str) -> None:
+        k = (hive, path.lower())
+        key = self._writable.get(k)
+        if key is None:
+            key = self._writable[k] = self.winreg.CreateKey(self._root(hive), path)
+        self.winreg.SetValueEx(key, name, 0, self.winreg.REG_SZ, value)
+        self._values[k + (name,)] = value
+        if k in self._handles and self._handles[k] is None:
+            del self._handles[k]  # exists now; reopen on demand
+
+    def delete_key(self, hive: str, path: str) -> None:
+        k = (hive, path.lower())
+        for handles in (self._handles, self._writable):
+            self._close(handles.pop(k, None))
+        self.winreg.DeleteKey(self._root(hive), path)
+        self._handles[k] = None
+        self._values = {vk: v for vk, v in self._values.items() if vk[:2] != k}
+
+    def _close(self, key) -> None:
+        if key is not None:
+            try:
+                self.winreg.CloseKey(key)
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        for key in list(self._handles.values()) + list(self._writable.values()):
+            self._close(key)
+        self._handles.clear()
+        self._writable.clear()
+        self._values.clear()
+
+
+def _background_state(hive: str, script_path: str) -> ShellState:
+    root, path = _BACKGROUND_KEYS["user" if hive == "user" else "system"]
+    return {
+        (root, path): {"": "Neue Python-Datei erstellen…", "Icon": sys.executable},
+        (root, path + r"\command"): {"": f'"{sys.executable}" "{script_path}" "%V"'},
+    }
+
+
+def _shellnew_state(hive: str, file_name: str) -> ShellState:
+    return {_SHELLNEW_KEYS["system" if hive == "system" else "user"]: {"FileName": file_name}}
+
+
+def desired_shell_state(background_hive: Optional[str] = "user", shellnew_hive: Optional[str] = "system",
+                        file_name: str = "NeuePythonDatei.py", script_path: Optional[str] = None) -> ShellState:
+    """
+    Describe the shell integration keys and values for the given hives
+    ("user" / "system"; None leaves that entry out). Raises
+    FileNotFoundError when the background entry is requested but
+    create_python_new.py cannot be found.
+    """
+    state: ShellState = {}
+    if background_hive is not None:
+        script_path = script_path or get_python_new_path()
+        if not script_path:
+            raise FileNotFoundError("create_python_new.py not found")
+        state.update(_background_state(background_hive, script_path))
+    if shellnew_hive is not None:
+        state.update(_shellnew_state(shellnew_hive, file_name))
+    return state
+
+
+def _plan(desired: ShellState, session: WinregSession) -> List[Tuple[Any, ...]]:
+    ops: List[Tuple[Any, ...]] = []
+    deletes = []
+    for (hive, path), values in desired.items():
+        if values is None:
+            if session.exists(hive, path):
+                deletes.append(("delete", hive, path))
+            continue
+        for name, value in values.items():
+            if session.query(hive, path, name) != value:
+                ops.append(("set", hive, path, name, value))
+    # subkeys before their parents
+    deletes.sort(key=lambda op: op[2].count("\\"), reverse=True)
+    return ops + deletes
+
+
+def _apply(ops: List[Tuple[Any, ...]], session: WinregSession) -> None:
+    for op in ops:
+        if op[0] == "set":
+            session.set_value(*op[1:])
+        else:
+            try:
+                session.delete_key(*op[1:])
+            except FileNotFoundError:
+                pass
+
+
+def plan_shell_state(desired: ShellState, winreg_module=None) -> List[Tuple[Any, ...]]:
+    """
+    Return the changes needed to reach `desired`: ("set", hive, path, name,
+    value) for every value that differs and ("delete", hive, path) for every
+    existing key marked None, deepest keys first.
+    """
+    with WinregSession(winreg_module) as session:
+        return _plan(desired, session)
+
+
+def apply_shell_state(desired: ShellState, winreg_module=None,
+                      session: Optional[WinregSession] = None) -> Tuple[bool, str]:
+    """
+    Bring the registry to `desired`, reading the current state once and
+    writing only the values that differ. Pass `session` to reuse reads made
+    through it (e.g. by shell_status()); it is left open. Returns (success, message).
+    """
+    own = session is None
+    if own:
+        try:
+            session = WinregSession(winreg_module)
+        except RuntimeError:
+            return False, "winreg not available on this platform"
+    try:
+        ops = _plan(desired, session)
+        _apply(ops, session)
+        return True, f"{len(ops)} change(s) applied" if ops else "Already up to date"
+    except PermissionError:
+        return False, "Permission denied applying shell registration"
+    except Exception as exc:
+        logging.exception("Failed to apply shell registration")
+        return False, str(exc)
+    finally:
+        if own:
+            session.close()
+
+
+def _probe_background(session: WinregSession) -> Tuple[bool, Optional[str]]:
+    # user hive first, then the system-wide one
+    for hive, path in (_BACKGROUND_KEYS["user"], _BACKGROUND_KEYS["system"]):
+        if session.exists(hive, path):
+            return True, hive
+    return False, None
+
+
+def _probe_shellnew(session: WinregSession) -> Tuple[bool, Optional[str], Optional[str]]:
+    # HKCR first, HKCU fallback
+    for hive, path in (_SHELLNEW_KEYS["system"], _SHELLNEW_KEYS["user"]):
+        if session.exists(hive, path):
+            value = session.query(hive, path, "FileName")
+            if value is _MISSING:
+                return False, hive, None
+            return True, hive, value
+    return False, None, None
+
+
+def shell_status(winreg_module=None, session: Optional[WinregSession] = None) -> Dict[str, Any]:
+    """
+    Probe both shell integrations through one session (`session` if given,
+    left open). Returns {"background": (exists, hive), "shellnew": (exists,
+    hive), "shellnew_file": FileName or None}.
+    """
+    if session is None:
+        try:
+            session = WinregSession(winreg_module)
+        except RuntimeError:
+            return {"background": (False, None), "shellnew": (False, None), "shellnew_file": None}
+        with session:
+            return shell_status(session=session)
+    ok_sn, hive_sn, file_name = _probe_shellnew(session)
+    return {"background": _probe_background(session), "shellnew": (ok_sn, hive_sn), "shellnew_file": file_name}
+
+
 def check_entry_background(winreg_module=None) -> Tuple[bool, Optional[str]]:
     """
     Check whether the background 'NeuePythonDatei' entry exists.
     Returns (exists: bool, hive: "HKCU" | "HKCR" | None)
     """
     try:
-        winreg = _get_winreg(winreg_module)
+        session = WinregSession(winreg_module)
     except RuntimeError:
         return False, None
-
-    key_name = r"Software\Classes\Directory\Background\shell\NeuePythonDatei"
-    # check user hive first
-    try:
-        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, key_name)
-        winreg.CloseKey(key)
-        return True, "HKCU"
-    except Exception:
-        pass
-
-    # check system-wide (HKCR) next
-    try:
-        key = winreg.OpenKey(winreg.HKEY_CLASSES_ROOT, key_name)
-        winreg.CloseKey(key)
-        return True, "HKCR"
-    except Exception:
-        pass
-
-    return False, None
+    with session:
+        return _probe_background(session)
 
 
 def create_entry_background(hive: str = "user", winreg_module=None) -> Tuple[bool, str]:
     """
     Create the background context menu entry in the specified hive.
     hive: "user" -> HKEY_CURRENT_USER, "system" -> HKEY_CLASSES_ROOT (requires admin)
+    Only values that differ from what is already registered are written.
     Returns (success, message)
     """
     try:
-        winreg = _get_winreg(winreg_module)
+        session = WinregSession(winreg_module)
     except RuntimeError:
         return False, "winreg not available on this platform"
 
     script_path = get_python_new_path()
     if not script_path:
+        session.close()
         return False, "create_python_new.py not found"
 
-    if hive == "user":
-        root = winreg.HKEY_CURRENT_USER
-        key_name = r"Software\Classes\Directory\Background\shell\NeuePythonDatei"
-    else:
-        root = winreg.HKEY_CLASSES_ROOT
-        key_name = r"Directory\Background\shell\NeuePythonDatei"  # under HKCR the prefix is different
-
-    try:
-        key = winreg.CreateKey(root, key_name)
-        winreg.SetValueEx(key, "", 0, winreg.REG_SZ, "Neue Python-Datei erstellen…")
-        winreg.SetValueEx(key, "Icon", 0, winreg.REG_SZ, sys.executable)
-        winreg.CloseKey(key)
-
-        # command subkey
-        key_cmd = winreg.CreateKey(root, key_name + r"\command")
-        command = f'"{sys.executable}" "{script_path}" "%V"'
-        winreg.SetValueEx(key_cmd, "", 0, winreg.REG_SZ, command)
-        winreg.CloseKey(key_cmd)
-        return True, f"Entry created in {hive}"
-    except PermissionError:
-        return False, f"Permission denied creating entry in {hive}"
-    except Exception as exc:
-        logging.exception("Failed to create background entry")
-        return False, str(exc)
+    with session:
+        try:
+            _apply(_plan(_background_state(hive, script_path), session), session)
+            return True, f"Entry created in {hive}"
+        except PermissionError:
+            return False, f"Permission denied creating entry in {hive}"
+        except Exception as exc:
+            logging.exception("Failed to create background entry")
+            return False, str(exc)
 
 
 def remove_entry_background(hive: str = "user", winreg_module=None) -> Tuple[bool, str]:
@@ -242,37 +695,11 @@ def check_shellnew_py(winreg_module=None) -> Tuple[bool, Optional[str]]:
     Returns (exists, hive) where hive is "HKCR" or "HKCU" or None.
     """
     try:
-        winreg = _get_winreg(winreg_module)
+        session = WinregSession(winreg_module)
     except RuntimeError:
         return False, None
-
-    # check HKCR first
-    try:
-        key = winreg.OpenKey(winreg.HKEY_CLASSES_ROOT, r".py\ShellNew")
-        try:
-            winreg.QueryValueEx(key, "FileName")
-            winreg.CloseKey(key)
-            return True, "HKCR"
-        except Exception:
-            winreg.CloseKey(key)
-            return False, "HKCR"
-    except Exception:
-        pass
-
-    # HKCU fallback
-    try:
-        key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Classes\.py\ShellNew")
-        try:
-            winreg.QueryValueEx(key, "FileName")
-            winreg.CloseKey(key)
-            return True, "HKCU"
-        except Exception:
-            winreg.CloseKey(key)
-            return False, "HKCU"
-    except Exception:
-        pass
-
-    return False, None
+    with session:
+        return _probe_shellnew(session)[:2]
 
 
 def create_shellnew_py(file_name: str = "NeuePythonDatei.py", hive: str = "system", winreg_module=None) -> Tuple[bool, str]:
@@ -280,27 +707,19 @@ def create_shellnew_py(file_name: str = "NeuePythonDatei.py", hive: str = "syste
     Create a ShellNew entry for .py files. hive: "system"->HKCR, "user"->HKCU
     """
     try:
-        winreg = _get_winreg(winreg_module)
+        session = WinregSession(winreg_module)
     except RuntimeError:
         return False, "winreg not available on this platform"
 
-    if hive == "system":
-        root = winreg.HKEY_CLASSES_ROOT
-        path = r".py\ShellNew"
-    else:
-        root = winreg.HKEY_CURRENT_USER
-        path = r"Software\Classes\.py\ShellNew"
-
-    try:
-        key = winreg.CreateKey(root, path)
-        winreg.SetValueEx(key, "FileName", 0, winreg.REG_SZ, file_name)
-        winreg.CloseKey(key)
-        return True, f".py ShellNew created in {hive}"
-    except PermissionError:
-        return False, f"Permission denied creating .py ShellNew in {hive}"
-    except Exception as exc:
-        logging.exception("Failed to create .py ShellNew")
-        return False, str(exc)
+    with session:
+        try:
+            _apply(_plan(_shellnew_state(hive, file_name), session), session)
+            return True, f".py ShellNew created in {hive}"
+        except PermissionError:
+            return False, f"Permission denied creating .py ShellNew in {hive}"
+        except Exception as exc:
+            logging.exception("Failed to create .py ShellNew")
+            return False, str(exc)
 
 
 def remove_shellnew_py(hive: str = "system", winreg_module=None) -> Tuple[bool, str]:
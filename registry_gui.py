@@ -333,41 +333,23 @@ class RegistryGUI(tk.Tk):
 
     def _load_shell_status(self):
         """Refresh background and ShellNew status and populate UI controls."""
-        # Background
+        # one registry session for both probes and the ShellNew FileName
         try:
-            ok, hive = registry.check_entry_background()
+            shell = registry.shell_status()
         except Exception:
-            ok, hive = False, None
+            shell = {"background": (False, None), "shellnew": (False, None), "shellnew_file": None}
+
+        ok, hive = shell["background"]
         if ok:
             self.bg_status_lbl.config(text=f"Present ({hive})")
             self.bg_hive_box.set("user" if hive == "HKCU" else "system")
         else:
             self.bg_status_lbl.config(text="Not present")
 
-        # ShellNew existence + filename (try reading directly via winreg for filename)
-        try:
-            ok2, hive2 = registry.check_shellnew_py()
-        except Exception:
-            ok2, hive2 = False, None
+        ok2, hive2 = shell["shellnew"]
         if ok2:
-            # attempt to read FileName value
-            fname = None
-            try:
-                import winreg  # type: ignore
-                # check HKCR first
-                if hive2 == "HKCR":
-                    key = winreg.OpenKey(winreg.HKEY_CLASSES_ROOT, r".py\ShellNew")
-                    fname, _ = winreg.QueryValueEx(key, "FileName")
-                    winreg.CloseKey(key)
-                    self.shellnew_hive_box.set("system")
-                else:
-                    key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Classes\.py\ShellNew")
-                    fname, _ = winreg.QueryValueEx(key, "FileName")
-                    winreg.CloseKey(key)
-                    self.shellnew_hive_box.set("user")
-            except Exception:
-                fname = ""
-            self.shellnew_file_var.set(fname or "")
+            self.shellnew_hive_box.set("system" if hive2 == "HKCR" else "user")
+            self.shellnew_file_var.set(shell["shellnew_file"] or "")
             self.status.config(text=f".py ShellNew: present ({hive2})")
         else:
             self.shellnew_file_var.set("")
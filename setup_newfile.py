@@ -31,7 +31,7 @@ def select_install_dir():
     return INSTALL_DIR
 
 # --- Dateien / Module ---
-MODULES = ["main.py", "gui.py", "registry.py", "templates.py", "cache.py", "create_python_new.py", "registry_gui.py"]
+MODULES = ["main.py", "gui.py", "registry.py", "templates.py", "cache.py", "locking.py", "create_python_new.py", "registry_gui.py"]
 WRAPPER = "create_python_new.bat"
 TEMPLATE_DIR = "templates"
 DUMMY_FILE = "dummy.py"
@@ -213,10 +213,6 @@ def install(
 
     # apply registry entries if requested
     if apply_registry:
-        ok_bg, msg_bg = registry.create_entry_background(hive=background_hive)
-        if not ok_bg:
-            logging.warning("Background entry creation failed: %s", msg_bg)
-
         tpl_name = "NeuePythonDatei.py"
         if shellnew_hive == "system":
             src_tpl = dst / TEMPLATE_DIR / tpl_name
@@ -224,11 +220,24 @@ def install(
                 ok_copy, copy_msg = _install_shellnew_template_to_system(src_tpl)
                 if not ok_copy:
                     logging.warning("Could not copy template to ShellNew system dir: %s", copy_msg)
-            ok_sn, msg_sn = registry.create_shellnew_py(tpl_name, hive="system")
+        try:
+            session = registry.WinregSession()
+        except RuntimeError as exc:
+            logging.warning("Shell registration skipped: %s", exc)
         else:
-            ok_sn, msg_sn = registry.create_shellnew_py(tpl_name, hive="user")
-        if not ok_sn:
-            logging.warning("ShellNew creation failed: %s", msg_sn)
+            # separate plans over one session, so a denied system hive does not block the user one
+            with session:
+                try:
+                    ok_bg, msg_bg = registry.apply_shell_state(
+                        registry.desired_shell_state(background_hive, None), session=session)
+                except FileNotFoundError as exc:
+                    ok_bg, msg_bg = False, str(exc)
+                if not ok_bg:
+                    logging.warning("Background entry creation failed: %s", msg_bg)
+                ok_sn, msg_sn = registry.apply_shell_state(
+                    registry.desired_shell_state(None, shellnew_hive, tpl_name), session=session)
+                if not ok_sn:
+                    logging.warning("ShellNew creation failed: %s", msg_sn)
 
     # optionally restart Explorer (Windows) and wait
     re_msg = ""
@@ -280,9 +289,10 @@ def status(install_dir: Optional[Path] = None) -> str:
     dst = Path(install_dir or _default_install_dir())
     lines = []
     lines.append(f"Install dir: {dst} (exists: {dst.exists()})")
-    ok_bg, hive_bg = registry.check_entry_background()
+    shell = registry.shell_status()
+    ok_bg, hive_bg = shell["background"]
     lines.append(f"Background entry: {ok_bg} (hive: {hive_bg})")
-    ok_sn, hive_sn = registry.check_shellnew_py()
+    ok_sn, hive_sn = shell["shellnew"]
     lines.append(f".py ShellNew: {ok_sn} (hive: {hive_sn})")
     return "\n".join(lines)
 
@@ -1,8 +1,20 @@
 import json
+import mmap
 import os
+import re
+import sqlite3
+import struct
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
 from string import Template
-from typing import Dict, Optional, Tuple, Any
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple, Union
 import uuid
 import time
 
@@ -12,32 +24,509 @@ def random_name(prefix: str = "template") -> str:
     return f"{prefix}_{uuid.uuid4().hex[:8]}.py"
 
 
+class TemplateCycleError(ValueError):
+    """Template variables reference each other in a cycle."""
+
+    def __init__(self, keys: List[str]):
+        self.keys = keys
+        super().__init__("cyclic template variables: " + ", ".join(keys))
+
+    def __reduce__(self):
+        # keep .keys intact when raised in a render_many worker process
+        return type(self), (self.keys,)
+
+
+class TemplateIncludeCycleError(TemplateCycleError):
+    """Templates include or extend each other in a cycle."""
+
+    def __init__(self, keys: List[str]):
+        self.keys = keys
+        ValueError.__init__(self, "cyclic template includes: " + " -> ".join(keys))
+
+
+# "#% include other.py", "#% extends base.py", "#% block name" ... "#% endblock", each on its own line
+_DIRECTIVE = re.compile(r"^#%[ \t]*(include|extends|block|endblock)\b[ \t]*(\S*)[ \t]*(?:\r?\n|\Z)", re.M)
+
+
+def _parse_directives(text: str, name: str) -> Tuple[Optional[str], List[Any]]:
+    """
+    Split a template into (extends target, nodes). Nodes are text, ("include",
+    name) and ("block", name, child nodes).
+    """
+    nodes: List[Any] = []
+    open_blocks = [nodes]
+    extends = None
+    pos = 0
+    for mo in _DIRECTIVE.finditer(text):
+        open_blocks[-1].append(text[pos:mo.start()])
+        pos = mo.end()
+        kind, arg = mo.group(1), mo.group(2)
+        if kind == "endblock":
+            if len(open_blocks) == 1:
+                raise ValueError(f"{name}: '#% endblock' without a block")
+            open_blocks.pop()
+            continue
+        if not arg:
+            raise ValueError(f"{name}: '#% {kind}' needs a name")
+        if kind == "include":
+            open_blocks[-1].append(("include", arg))
+        elif kind == "extends":
+            extends = arg
+        else:
+            block = ("block", arg, [])
+            open_blocks[-1].append(block)
+            open_blocks.append(block[2])
+    if len(open_blocks) > 1:
+        raise ValueError(f"{name}: unclosed '#% block'")
+    open_blocks[-1].append(text[pos:])
+    return extends, nodes
+
+
+def _references(text: str) -> List[str]:
+    """Distinct names of the ${name} / $name placeholders in text, in order of first use."""
+    if "$" not in text:
+        return []
+    names: Dict[str, None] = {}
+    # findall yields (escaped, named, braced, invalid) per match
+    for _, named, braced, _ in Template.pattern.findall(text):
+        if named or braced:
+            names[named or braced] = None
+    return list(names)
+
+
+def _expand_vars(vars: Dict[str, str]) -> Dict[str, str]:
+    """
+    Expand references between variable values (as Template.safe_substitute
+    would), resolving each value once after the values it references.
+    Iterative depth-first, so deep chains need no recursion. Raises
+    TemplateCycleError naming the keys on a cycle.
+    """
+    # values without placeholders are final as they are
+    out = {k: v for k, v in vars.items() if "$" not in v}
+    if len(out) == len(vars):
+        return out
+    missing: List[str] = []  # referenced variables not expanded yet, per scan
+
+    def convert(mo):
+        name = mo.group("named") or mo.group("braced")
+        if name is not None:
+            value = out.get(name)
+            if value is not None:
+                return value
+            if name in vars:
+                missing.append(name)
+            return mo.group()
+        if mo.group("escaped") is not None:
+            return Template.delimiter
+        return mo.group()
+
+    for root in vars:
+        if root in out:
+            continue
+        stack = [(root, False)]
+        path: Dict[str, None] = {}  # keys waiting on their references, in depth-first order
+        while stack:
+            key, resumed = stack.pop()
+            if resumed:
+                del path[key]
+            elif key in out:
+                continue
+            missing.clear()
+            value = Template.pattern.sub(convert, vars[key])
+            if not missing:
+                out[key] = value
+                continue
+            for dep in missing:
+                if dep == key or dep in path:
+                    on_path = list(path)
+                    start = on_path.index(dep) if dep in path else len(on_path)
+                    raise TemplateCycleError(on_path[start:] + [key])
+            path[key] = None
+            stack.append((key, True))
+            stack.extend((dep, False) for dep in reversed(missing))
+    return out
+
+
+def _prepare_vars(vars: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    # prepare vars as strings
+    vars = {k: ("" if v is None else str(v)) for k, v in (vars or {}).items()}
+    # first expand nested references inside variable values
+    return _expand_vars(vars)
+
+
+def _render(content: str, tpl: Template, vars: Optional[Dict[str, Any]]) -> str:
+    if not content:
+        return ""
+    vars = _prepare_vars(vars)
+    try:
+        return tpl.safe_substitute(vars)
+    except Exception:
+        return content
+
+
+def _render_chunks(content: str, tpl: Template, vars: Dict[str, str], chunk_chars: int = 1 << 16) -> Iterator[str]:
+    """
+    Yield _render's output for already prepared vars in pieces, substituting
+    as Template.safe_substitute does without building the whole result.
+    Pieces end at the first newline after chunk_chars characters; no
+    placeholder spans a newline, so each piece is substituted on its own.
+    """
+    if not content:
+        return
+
+    def convert(mo):
+        name = mo.group("named") or mo.group("braced")
+        if name is not None:
+            value = vars.get(name)
+            return mo.group() if value is None else value
+        if mo.group("escaped") is not None:
+            return tpl.delimiter
+        return mo.group()
+
+    sub = tpl.pattern.sub
+    pos = 0
+    while pos < len(content):
+        end = content.find("\n", pos + chunk_chars) + 1 or len(content)
+        yield sub(convert, content[pos:end])
+        pos = end
+
+
+class SqliteMetaStore(MutableMapping):
+    """
+    Template metadata as one row per template in a sqlite3 database, for
+    libraries too large to rewrite templates.json on every change. Behaves
+    like the metadata dict; changes become durable on commit().
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._conn.commit()
+
+    def __getitem__(self, name: str) -> Dict[str, Any]:
+        row = self._conn.execute("SELECT data FROM meta WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return json.loads(row[0])
+
+    def __setitem__(self, name: str, data: Dict[str, Any]) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (name, data) VALUES (?, ?)",
+                           (name, json.dumps(data, ensure_ascii=False)))
+
+    def __delitem__(self, name: str) -> None:
+        if self._conn.execute("DELETE FROM meta WHERE name = ?", (name,)).rowcount == 0:
+            raise KeyError(name)
+
+    def __contains__(self, name: object) -> bool:
+        return self._conn.execute("SELECT 1 FROM meta WHERE name = ?", (name,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([row[0] for row in self._conn.execute("SELECT name FROM meta ORDER BY name")])
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM meta").fetchone()[0]
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class TemplateBundle:
+    """
+    Read-only templates packed into a zip archive (see pack_templates). The
+    central directory is the listing; the archive is memory-mapped and stored
+    members are sliced straight out of the mapping (deflated ones are
+    inflated on read). Only top-level .py members and templates.json are used.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with zipfile.ZipFile(str(self.path)) as zf:
+            infos = [i for i in zf.infolist() if "/" not in i.filename]
+        self._members: Dict[str, zipfile.ZipInfo] = {i.filename: i for i in infos}
+        self._names = sorted(n for n in self._members if n.endswith(".py"))
+        with open(str(self.path), "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def names(self) -> List[str]:
+        return list(self._names)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._members
+
+    def sig(self, name: str) -> Tuple[int, int]:
+        # negative "mtime" so a bundled version never equals an overlay file's (mtime_ns, size)
+        info = self._members[name]
+        return -1 - info.header_offset, info.file_size
+
+    def read_bytes(self, name: str) -> bytes:
+        info = self._members[name]
+        off = info.header_offset
+        # local file header: 30 fixed bytes, then the file name and extra field
+        if self._map[off:off + 4] != b"PK\x03\x04":
+            raise zipfile.BadZipFile(f"bad local header for {name}")
+        name_len, extra_len = struct.unpack("<HH", self._map[off + 26:off + 30])
+        start = off + 30 + name_len + extra_len
+        data = self._map[start:start + info.compress_size]
+        if info.compress_type == zipfile.ZIP_STORED:
+            return data
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+        with zipfile.ZipFile(str(self.path)) as zf:
+            return zf.read(name)
+
+    def read_text(self, name: str) -> str:
+        return self.read_bytes(name).decode("utf-8")
+
+    def close(self) -> None:
+        """Unmap the archive; on Windows the file cannot be replaced while it is mapped."""
+        self._map.close()
+
+    def __enter__(self) -> "TemplateBundle":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def pack_templates(src_dir: Union[str, Path], bundle_path: Union[str, Path], compress: bool = False) -> Path:
+    """
+    Pack the .py templates and templates.json of src_dir into a zip bundle for
+    TemplatesManager(bundle=...). Members are stored uncompressed by default so
+    they can be read straight from the memory map.
+    """
+    src_dir = Path(src_dir)
+    bundle_path = Path(bundle_path)
+    method = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    tmp = bundle_path.with_name(f".{bundle_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        with zipfile.ZipFile(str(tmp), "x", compression=method) as zf:
+            for p in sorted(src_dir.iterdir()):
+                if p.is_file() and (p.suffix == ".py" or p.name == "templates.json"):
+                    zf.write(str(p), p.name)
+        os.replace(str(tmp), str(bundle_path))
+    finally:
+        if tmp.exists():
+            try:
+                tmp.unlink()
+            except Exception:
+                pass
+    return bundle_path
+
+
+def _write_json(path: Path, data: Any) -> None:
+    # unique temp name, so concurrent writers never share a half-written file
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, str(path))
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+
+
+# template compiled once per render_many worker process
+_worker_template: Optional[Tuple[str, Template]] = None
+
+
+def _init_worker(content: str) -> None:
+    global _worker_template
+    _worker_template = (content, Template(content))
+
+
+def _render_chunk(chunk: List[Optional[Dict[str, Any]]]) -> List[str]:
+    content, tpl = _worker_template
+    return [_render(content, tpl, vars) for vars in chunk]
+
+
 class TemplatesManager:
-    def __init__(self, templates_dir: Path):
+    """
+    Templates stored as .py files in templates_dir. Metadata lives in
+    templates.json, or with meta_store="sqlite" in templates.sqlite3 (seeded
+    from templates.json on first use).
+
+    With lazy=True the constructor does no I/O: the directory is created and
+    metadata read on first use (or by preload(), e.g. on a background
+    thread), and the starter templates are only written by an explicit
+    ensure_default_templates().
+
+    With a bundle (a zip made by pack_templates), the bundled templates are
+    the read-only base and templates_dir is an overlay: saves go to the
+    directory and shadow the bundled version, deleting a bundled template
+    records it in bundle_hidden.json.
+    """
+
+    def __init__(self, templates_dir: Path, cache_size: int = 128, meta_store: str = "json", lazy: bool = False,
+                 bundle: Optional[Union[str, Path]] = None):
+        if meta_store not in ("json", "sqlite"):
+            raise ValueError(f"unknown meta_store {meta_store!r}")
         self.templates_dir = Path(templates_dir)
-        self.templates_dir.mkdir(parents=True, exist_ok=True)
         self._meta_file = self.templates_dir / "templates.json"
-        self._meta: Dict[str, Dict[str, Any]] = {}
-        self._load_meta()
-        self._ensure_default_templates()
+        self.meta_store = meta_store
+        self._meta_data: Any = None  # loaded on first use, see _meta
+        self.bundle_path = Path(bundle) if bundle is not None else None
+        self._bundle: Optional[TemplateBundle] = None
+        self._hidden_file = self.templates_dir / "bundle_hidden.json"
+        self._hidden: Dict[str, None] = {}  # bundled templates deleted in the overlay
+        self._load_lock = threading.Lock()
+        # batch() nesting depth; metadata writes inside a batch are deferred to its end
+        self._batch_depth = 0
+        self._meta_dirty = False
+        # LRU of name -> ((mtime_ns, size), content, compiled Template)
+        self.cache_size = cache_size
+        self._compiled: "OrderedDict[str, Tuple[Tuple[int, int], str, Template]]" = OrderedDict()
+        # LRU of name -> (((dependency, signature), ...), content with includes/extends resolved, Template)
+        # and the reverse edges: template -> templates that include or extend it
+        self._resolved: "OrderedDict[str, Tuple[Tuple[Tuple[str, Tuple[int, int]], ...], str, Template]]" = OrderedDict()
+        self._dependents: Dict[str, Set[str]] = {}
+        # index of name -> (mtime_ns, size), valid while the directory mtime equals _index_sig
+        self._index: Optional[Dict[str, Tuple[int, int]]] = None
+        self._index_sig: Optional[int] = None
+        self._index_names: List[str] = []
+        # placeholders per template version: name -> (version, names); the reverse
+        # variable -> templates index is built on first use and then kept up to date from
+        # _vars_stale, the names the index saw change since
+        self._vars: Dict[str, Tuple[Any, List[str]]] = {}
+        self._var_index: Optional[Dict[str, Set[str]]] = None
+        self._vars_stale: Set[str] = set()
+        if not lazy:
+            self._ensure_loaded()
+            self.ensure_default_templates()
 
-    def _load_meta(self) -> None:
-        if not self._meta_file.exists():
-            self._meta = {}
+    @property
+    def _meta(self) -> Any:
+        if self._meta_data is None:
+            self._ensure_loaded()
+        return self._meta_data
+
+    def _ensure_loaded(self) -> None:
+        if self._meta_data is not None:
             return
+        with self._load_lock:
+            if self._meta_data is None:
+                self.templates_dir.mkdir(parents=True, exist_ok=True)
+                if self.bundle_path is not None:
+                    self._bundle = TemplateBundle(self.bundle_path)
+                    if self._hidden_file.exists():
+                        self._hidden = dict.fromkeys(json.loads(self._hidden_file.read_text(encoding="utf-8")))
+                self._meta_data = self._open_meta()
+
+    def close(self) -> None:
+        """
+        Release the bundle mapping and the sqlite metadata connection (if any).
+        Call it when done with the manager, e.g. before re-packing the bundle.
+        """
+        with self._load_lock:
+            bundle, self._bundle = self._bundle, None
+            meta, self._meta_data = self._meta_data, None
+        if bundle is not None:
+            bundle.close()
+        if isinstance(meta, SqliteMetaStore):
+            meta.close()
+
+    def __enter__(self) -> "TemplatesManager":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def preload(self) -> None:
+        """Read metadata and list the templates now rather than on first use."""
+        self._ensure_loaded()
+        self._ensure_index()
+
+    def _read_meta_json(self) -> Dict[str, Dict[str, Any]]:
+        meta: Dict[str, Dict[str, Any]] = {}
+        if self._bundle is not None and "templates.json" in self._bundle:
+            # bundled metadata is the base; the overlay's templates.json wins per template
+            meta = json.loads(self._bundle.read_text("templates.json")) or {}
+        if not self._meta_file.exists():
+            return meta
         try:
             raw = self._meta_file.read_text(encoding="utf-8")
-            self._meta = json.loads(raw) or {}
+            meta.update(json.loads(raw) or {})
+            return meta
         except Exception:
             # corrupted -> reset metadata
-            self._meta = {}
+            return {}
+
+    def _open_meta(self) -> Any:
+        if self.meta_store == "json":
+            return self._read_meta_json()
+        db = self.templates_dir / "templates.sqlite3"
+        seed = not db.exists()
+        store = SqliteMetaStore(db)
+        if seed:
+            store.update(self._read_meta_json())
+            store.commit()
+        return store
 
     def _save_meta(self) -> None:
-        tmp = str(self._meta_file) + ".tmp"
-        os.makedirs(os.path.dirname(str(self._meta_file)), exist_ok=True)
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(self._meta, f, indent=2, ensure_ascii=False)
-        os.replace(tmp, str(self._meta_file))
+        if self._batch_depth:
+            self._meta_dirty = True
+            return
+        self._write_meta()
+
+    def _write_meta(self) -> None:
+        if self.meta_store == "sqlite":
+            self._meta.commit()
+            return
+        _write_json(self._meta_file, self._meta)
+
+    def _in_bundle(self, name: str) -> bool:
+        return self._bundle is not None and name.endswith(".py") and name in self._bundle and name not in self._hidden
+
+    def _set_hidden(self, name: str, hidden: bool) -> None:
+        """Hide (delete) or unhide a bundled template in the overlay."""
+        if self._bundle is None or name not in self._bundle or (name in self._hidden) == hidden:
+            return
+        if hidden:
+            self._hidden[name] = None
+        else:
+            del self._hidden[name]
+        _write_json(self._hidden_file, list(self._hidden))
+
+    def _template_sig(self, name: str) -> Optional[Tuple[int, int]]:
+        """(mtime_ns, size) of the overlay file, else the bundled member's signature; None if missing."""
+        self._ensure_loaded()
+        try:
+            st = (self.templates_dir / name).stat()
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            pass
+        if self._in_bundle(name):
+            return self._bundle.sig(name)
+        return None
+
+    @contextmanager
+    def batch(self):
+        """
+        Group template changes so metadata is written once, when the outermost
+        batch exits (also when it exits with an exception, since the template
+        files themselves were already changed).
+
+            with tm.batch():
+                for name, text in generated:
+                    tm.save_template(name, text)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._meta_dirty:
+                self._meta_dirty = False
+                fresh = self._index_fresh()
+                self._write_meta()
+                self._index_update(fresh)
 
     def _sanitize_name(self, name: str) -> str:
         base = os.path.basename(name)
@@ -45,10 +534,300 @@ class TemplatesManager:
             base = base + ".py"
         return base
 
-    def _ensure_default_templates(self):
-        # Provide at least one starter template if none exist.
-        if any(self.list_templates()):
+    def _compiled_template(self, name: str) -> Optional[Tuple[str, Template]]:
+        """
+        Return (content, Template) for a sanitized name, re-reading the file only
+        when its (mtime, size) changed. None if the template does not exist.
+        """
+        raw = self._raw_template(name)
+        return None if raw is None else (raw[1], raw[2])
+
+    def _raw_template(self, name: str) -> Optional[Tuple[Tuple[int, int], str, Template]]:
+        sig = self._template_sig(name)
+        if sig is None:
+            self._compiled.pop(name, None)
+            return None
+        hit = self._compiled.get(name)
+        if hit is not None and hit[0] == sig:
+            self._compiled.move_to_end(name)
+            return hit
+        if sig[0] < 0:
+            content = self._bundle.read_text(name)
+        else:
+            content = (self.templates_dir / name).read_text(encoding="utf-8")
+        tpl = Template(content)
+        self._compiled[name] = (sig, content, tpl)
+        self._compiled.move_to_end(name)
+        while len(self._compiled) > self.cache_size:
+            self._compiled.popitem(last=False)
+        return sig, content, tpl
+
+    def _resolved_template(self, name: str) -> Optional[Tuple[Any, str, Template]]:
+        """
+        Return (version, content, Template) for a sanitized name with its
+        include/extends directives resolved; version is the signatures of every
+        file it was built from. A cached result is reused while none of those
+        files changed, so a render costs one stat per dependency and no reads.
+        None if the template does not exist; raises TemplateIncludeCycleError,
+        FileNotFoundError for a missing include, ValueError for bad directives.
+        """
+        hit = self._resolved.get(name)
+        if hit is not None and all(self._template_sig(dep) == sig for dep, sig in hit[0]):
+            self._resolved.move_to_end(name)
+            return hit
+        raw = self._raw_template(name)
+        if raw is None:
+            self._resolved.pop(name, None)
+            return None
+        deps: Dict[str, Tuple[int, int]] = {name: raw[0]}
+        if _DIRECTIVE.search(raw[1]) is None:
+            # plain template: share the compiled Template
+            entry = ((name, raw[0]),), raw[1], raw[2]
+        else:
+            content = self._resolve(name, [], deps, {})
+            entry = tuple(deps.items()), content, Template(content)
+        old = self._resolved.get(name)
+        for dep, _ in old[0] if old else ():
+            self._dependents.get(dep, set()).discard(name)
+        for dep in deps:
+            if dep != name:
+                self._dependents.setdefault(dep, set()).add(name)
+        self._resolved[name] = entry
+        self._resolved.move_to_end(name)
+        while len(self._resolved) > self.cache_size:
+            self._resolved.popitem(last=False)
+        return entry
+
+    def _resolve(self, name: str, stack: List[str], deps: Dict[str, Tuple[int, int]],
+                 overrides: Dict[str, str]) -> str:
+        """Expand name's directives; overrides are block contents from templates extending it."""
+        if name in stack:
+            raise TemplateIncludeCycleError(stack[stack.index(name):] + [name])
+        raw = self._raw_template(name)
+        if raw is None:
+            raise FileNotFoundError(f"template {name} not found" + (f" (included from {stack[-1]})" if stack else ""))
+        deps[name] = raw[0]
+        extends, nodes = _parse_directives(raw[1], name)
+        stack.append(name)
+        try:
+            if extends is None:
+                out: List[str] = []
+                self._emit(nodes, overrides, stack, deps, out)
+                return "".join(out)
+            # a child template contributes only its blocks; those of templates extending it win
+            blocks: Dict[str, str] = {}
+            self._collect_blocks(nodes, overrides, stack, deps, blocks)
+            blocks.update(overrides)
+            return self._resolve(self._sanitize_name(extends), stack, deps, blocks)
+        finally:
+            stack.pop()
+
+    def _emit(self, nodes: List[Any], overrides: Dict[str, str], stack: List[str],
+              deps: Dict[str, Tuple[int, int]], out: List[str]) -> None:
+        for node in nodes:
+            if isinstance(node, str):
+                out.append(node)
+            elif node[0] == "include":
+                out.append(self._resolve(self._sanitize_name(node[1]), stack, deps, {}))
+            elif node[1] in overrides:
+                out.append(overrides[node[1]])
+            else:
+                self._emit(node[2], overrides, stack, deps, out)
+
+    def _collect_blocks(self, nodes: List[Any], overrides: Dict[str, str], stack: List[str],
+                        deps: Dict[str, Tuple[int, int]], blocks: Dict[str, str]) -> None:
+        for node in nodes:
+            if isinstance(node, tuple) and node[0] == "block":
+                out: List[str] = []
+                self._emit(node[2], overrides, stack, deps, out)
+                blocks[node[1]] = "".join(out)
+                self._collect_blocks(node[2], overrides, stack, deps, blocks)
+
+    def _invalidate(self, name: str) -> None:
+        """Drop cached compilations of name and of every template built from it."""
+        self._compiled.pop(name, None)
+        todo = [name]
+        seen: Set[str] = set()
+        while todo:
+            n = todo.pop()
+            if n in seen:
+                continue
+            seen.add(n)
+            self._resolved.pop(n, None)
+            todo.extend(self._dependents.get(n, ()))
+
+    def _dir_mtime(self) -> Optional[int]:
+        try:
+            return self.templates_dir.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _scan(self, full: bool = False) -> None:
+        """
+        Rebuild the index from the directory listing. Unless full, files already
+        in the index keep their recorded (mtime, size) and only new names are
+        stat'ed.
+        """
+        self._ensure_loaded()
+        # taken before listing, so a change during the scan triggers the next one
+        sig = self._dir_mtime()
+        old = {} if full or self._index is None else self._index
+        index: Dict[str, Tuple[int, int]] = {}
+        if sig is not None:
+            with os.scandir(self.templates_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".py"):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        st = old.get(entry.name)
+                        if st is None:
+                            est = entry.stat()
+                            st = (est.st_mtime_ns, est.st_size)
+                    except OSError:
+                        continue
+                    index[entry.name] = st
+        if self._bundle is not None:
+            # the bundle's listing comes from its central directory; the overlay shadows it
+            for name in self._bundle.names():
+                if name not in index and name not in self._hidden:
+                    index[name] = self._bundle.sig(name)
+        if self._var_index is not None:
+            self._vars_stale.update(index.keys() ^ old.keys())
+            self._vars_stale.update(n for n, st in index.items() if old.get(n, st) != st)
+        self._index = index
+        self._index_sig = sig
+        self._index_names = sorted(index)
+
+    def _ensure_index(self) -> Dict[str, Tuple[int, int]]:
+        if self._index is None or self._dir_mtime() != self._index_sig:
+            self._scan()
+        return self._index
+
+    def _index_fresh(self) -> bool:
+        return self._index is not None and self._dir_mtime() == self._index_sig
+
+    def _index_update(self, fresh: bool, *names: str) -> None:
+        """
+        Record this manager's own changes to names in the index. When the index
+        was current before the change (fresh), it stays current without a rescan.
+        """
+        if self._var_index is not None:
+            self._vars_stale.update(names)
+        if self._index is None:
+            return
+        for name in names:
+            sig = self._template_sig(name)
+            if sig is None:
+                self._index.pop(name, None)
+            else:
+                self._index[name] = sig
+        self._index_names = sorted(self._index)
+        if fresh:
+            self._index_sig = self._dir_mtime()
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Bring the template index up to date. Changes are normally picked up
+        through the directory mtime; force re-lists and re-stats every file,
+        e.g. after templates were edited in place by another program or on file
+        systems with coarse timestamps.
+        """
+        if force:
+            self._scan(full=True)
+        else:
+            self._ensure_index()
+
+    def index(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Return name -> {"size", "mtime_ns", "meta"} for all templates, from the
+        index (no template is read). Placeholders come from template_vars().
+        """
+        idx = self._ensure_index()
+        return {
+            name: {"size": idx[name][1], "mtime_ns": idx[name][0], "meta": self._meta.get(name, {})}
+            for name in self._index_names
+        }
+
+    def template_vars(self, name: str) -> List[str]:
+        """
+        Placeholder names used by a template (including what it includes or
+        extends), in order of first use. Extracted once per version of the
+        files involved, not taken from the hand-written "vars" metadata. A
+        template whose directives cannot be resolved reports its own
+        placeholders.
+        """
+        name = self._sanitize_name(name)
+        try:
+            resolved = self._resolved_template(name)
+        except (ValueError, FileNotFoundError):
+            raw = self._raw_template(name)
+            resolved = (((name, raw[0]),), raw[1], raw[2]) if raw is not None else None
+        if resolved is None:
+            self._set_vars(name, None)
+            return []
+        hit = self._vars.get(name)
+        if hit is not None and hit[0] == resolved[0]:
+            return list(hit[1])
+        names = _references(resolved[1])
+        self._set_vars(name, (resolved[0], names))
+        return list(names)
+
+    def _set_vars(self, name: str, entry: Optional[Tuple[Any, List[str]]]) -> None:
+        old = self._vars.pop(name, None) if entry is None else self._vars.get(name)
+        if entry is not None:
+            self._vars[name] = entry
+        if self._var_index is None:
+            return
+        for var in old[1] if old else ():
+            users = self._var_index.get(var)
+            if users is not None:
+                users.discard(name)
+                if not users:
+                    del self._var_index[var]
+        for var in entry[1] if entry else ():
+            self._var_index.setdefault(var, set()).add(name)
+
+    def _sync_vars(self) -> None:
+        """Bring placeholders and the reverse index up to date with the template index."""
+        idx = self._ensure_index()
+        if self._var_index is None:
+            # first use: extract every template once
+            self._vars_stale.clear()
+            for name in list(self._vars):
+                if name not in idx:
+                    del self._vars[name]
+            for name in idx:
+                self.template_vars(name)
+            self._var_index = {}
+            for name, (_, names) in self._vars.items():
+                for var in names:
+                    self._var_index.setdefault(var, set()).add(name)
             return
+        stale, self._vars_stale = self._vars_stale, set()
+        # templates built from a changed file changed too
+        todo = list(stale)
+        while todo:
+            for dependent in self._dependents.get(todo.pop(), ()):
+                if dependent not in stale:
+                    stale.add(dependent)
+                    todo.append(dependent)
+        for name in stale:
+            if name in idx:
+                self.template_vars(name)
+            else:
+                self._set_vars(name, None)
+
+    def templates_using(self, var: str) -> List[str]:
+        """Names of the templates with a ${var} placeholder."""
+        self._sync_vars()
+        return sorted(self._var_index.get(var, ()))
+
+    def ensure_default_templates(self) -> bool:
+        """Write the starter templates if there are no templates yet; True if they were written."""
+        if any(self.list_templates()):
+            return False
         starter = (
             "#!/usr/bin/env python3\n"
             '"""Starter template: ${description}"""\n\n'
@@ -83,44 +862,52 @@ class TemplatesManager:
                 "vars": ["name", "description", "author", "license", "created_date"],
             },
         )
+        return True
 
     def list_templates(self) -> list:
-        out = []
-        for p in sorted(self.templates_dir.iterdir()):
-            if p.is_file() and p.name.endswith(".py"):
-                out.append(p.name)
-        return out
+        self._ensure_index()
+        return list(self._index_names)
 
     def create_template(self, name: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        self._ensure_loaded()
         name = self._sanitize_name(name)
         path = self.templates_dir / name
-        if path.exists():
+        if self._template_sig(name) is not None:
             raise FileExistsError(name)
+        fresh = self._index_fresh()
         path.write_text(content, encoding="utf-8")
+        self._set_hidden(name, False)
+        self._invalidate(name)
         self._meta[name] = metadata or {}
         self._save_meta()
+        self._index_update(fresh, name)
 
     def save_template(self, name: str, content: str, metadata: Optional[Dict[str, Any]] = None, overwrite: bool = True) -> None:
+        self._ensure_loaded()
         name = self._sanitize_name(name)
         path = self.templates_dir / name
-        if path.exists() and not overwrite:
+        if not overwrite and self._template_sig(name) is not None:
             raise FileExistsError(name)
+        fresh = self._index_fresh()
         path.write_text(content, encoding="utf-8")
+        self._set_hidden(name, False)
+        self._invalidate(name)
         if metadata is not None:
             self._meta[name] = metadata
         else:
             # preserve existing meta if any
             self._meta.setdefault(name, {})
         self._save_meta()
+        self._index_update(fresh, name)
 
     def load_template(self, name: str, with_meta: bool = False) -> Any:
         name = self._sanitize_name(name)
-        path = self.templates_dir / name
-        if not path.exists():
+        compiled = self._compiled_template(name)
+        if compiled is None:
             if with_meta:
                 return "", self._meta.get(name, {})
             return ""
-        content = path.read_text(encoding="utf-8")
+        content = compiled[0]
         if with_meta:
             return content, self._meta.get(name, {})
         return content
@@ -130,15 +917,22 @@ class TemplatesManager:
         return self._meta.get(name, {})
 
     def delete_template(self, name: str) -> bool:
+        self._ensure_loaded()
         name = self._sanitize_name(name)
         path = self.templates_dir / name
         removed = False
+        fresh = self._index_fresh()
+        self._invalidate(name)
         if path.exists():
             path.unlink()
             removed = True
+        if self._in_bundle(name):
+            self._set_hidden(name, True)
+            removed = True
         if name in self._meta:
             del self._meta[name]
             self._save_meta()
+        self._index_update(fresh, name)
         return removed
 
     def rename_template(self, old: str, new: str) -> None:
@@ -146,44 +940,119 @@ class TemplatesManager:
         newn = self._sanitize_name(new)
         oldp = self.templates_dir / oldn
         newp = self.templates_dir / newn
-        if not oldp.exists():
+        if self._template_sig(oldn) is None:
             raise FileNotFoundError(oldn)
-        if newp.exists():
+        if self._template_sig(newn) is not None:
             raise FileExistsError(newn)
-        oldp.replace(newp)
+        fresh = self._index_fresh()
+        if oldp.exists():
+            oldp.replace(newp)
+        else:
+            # bundled only: copy the bundled text into the overlay under the new name
+            newp.write_bytes(self._bundle.read_bytes(oldn))
+        self._set_hidden(newn, False)
+        if self._in_bundle(oldn):
+            self._set_hidden(oldn, True)
+        self._invalidate(oldn)
+        self._invalidate(newn)
         # move metadata
         if oldn in self._meta:
             self._meta[newn] = self._meta.pop(oldn)
             self._save_meta()
+        self._index_update(fresh, oldn, newn)
 
     def render_template(self, name: str, vars: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Substitute vars into the template. Values may reference other variables
+        (${other}); those are expanded first, in dependency order, and the content
+        is then substituted in a single pass. Substituted text is never re-parsed,
+        so a "$" produced by a substitution or a "$$" escape stays literal. Raises
+        TemplateCycleError when variables reference each other in a cycle.
+        """
         name = self._sanitize_name(name)
-        content = self.load_template(name)
-        if not content:
+        resolved = self._resolved_template(name)
+        if resolved is None:
             return ""
-        # prepare vars as strings
-        vars = {k: ("" if v is None else str(v)) for k, v in (vars or {}).items()}
+        return _render(resolved[1], resolved[2], vars)
+
+    def render_to(self, name: str, vars: Optional[Dict[str, Any]], dest: Union[str, Path, TextIO]) -> None:
+        """
+        Render like render_template, streaming the output in chunks instead of
+        returning it. dest is either a text file object (written to as is) or a
+        path, which is replaced atomically once the whole output is written.
+        """
+        name = self._sanitize_name(name)
+        resolved = self._resolved_template(name)
+        content, tpl = (resolved[1], resolved[2]) if resolved is not None else ("", Template(""))
+        # expand vars before touching dest, so a cycle leaves it alone
+        vars = _prepare_vars(vars)
+        if hasattr(dest, "write"):
+            for chunk in _render_chunks(content, tpl, vars):
+                dest.write(chunk)
+            return
+        path = Path(dest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # unique sibling name; created with default permissions, unlike mkstemp
+        tmp = str(path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp"))
         try:
-            # first expand nested references inside variable values
-            for _ in range(10):
-                changed = False
-                for k, v in list(vars.items()):
-                    new_v = Template(v).safe_substitute(vars)
-                    if new_v != v:
-                        vars[k] = new_v
-                        changed = True
-                if not changed:
-                    break
-            # iterative content substitution
-            current = content
-            for _ in range(10):
-                new = Template(current).safe_substitute(vars)
-                if new == current:
-                    break
-                current = new
-            return current
-        except Exception:
-            return content
+            with open(tmp, "x", encoding="utf-8") as f:
+                for chunk in _render_chunks(content, tpl, vars):
+                    f.write(chunk)
+            os.replace(tmp, str(path))
+        finally:
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except Exception:
+                    pass
+
+    def render_many(self, name: str, var_sets: Iterable[Optional[Dict[str, Any]]], workers: Optional[int] = None,
+                    ordered: bool = True, chunk_size: int = 256) -> Iterator[Any]:
+        """
+        Render the template once per dict in var_sets, spread over a pool of
+        `workers` processes (default: one per CPU; 0 or 1 renders in this
+        process). The template is read once and compiled once per worker;
+        var_sets is consumed lazily in chunks of chunk_size, with at most two
+        chunks per worker in flight, so arbitrarily long streams use bounded
+        memory.
+
+        Yields the rendered strings in input order, or (index, text) pairs as
+        chunks complete when ordered is False.
+        """
+        name = self._sanitize_name(name)
+        resolved = self._resolved_template(name)
+        content, tpl = (resolved[1], resolved[2]) if resolved is not None else ("", Template(""))
+        it = iter(var_sets)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers <= 1:
+            for i, vars in enumerate(it):
+                yield _render(content, tpl, vars) if ordered else (i, _render(content, tpl, vars))
+            return
+        chunks = iter(lambda: list(islice(it, chunk_size)), [])
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(content,)) as pool:
+            pending: deque = deque()  # (first index, future) in submission order
+            start = 0
+            for chunk in islice(chunks, workers * 2):
+                pending.append((start, pool.submit(_render_chunk, chunk)))
+                start += len(chunk)
+            while pending:
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    finished = wait([f for _, f in pending], return_when=FIRST_COMPLETED).done
+                    done = [p for p in pending if p[1] in finished]
+                    for p in done:
+                        pending.remove(p)
+                # refill one chunk per completed one before handing results out
+                for chunk in islice(chunks, len(done)):
+                    pending.append((start, pool.submit(_render_chunk, chunk)))
+                    start += len(chunk)
+                for first, future in done:
+                    if ordered:
+                        yield from future.result()
+                    else:
+                        yield from enumerate(future.result(), first)
 
 
 # Backwards compatibility alias
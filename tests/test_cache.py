@@ -1,5 +1,13 @@
+import asyncio
+import json
+import os
+import subprocess
+import pytest
+import sys
 import time
-from cache import SimpleCache
+import threading
+from pathlib import Path
+from cache import AsyncCache, ShardedCache, SimpleCache
 
 def test_cache_basic(tmp_path):
     path = tmp_path / "c.json"
@@ -17,4 +25,375 @@ def test_cache_basic(tmp_path):
     # get_or_compute
     v = c.get_or_compute("compute", lambda: 999, ttl=1)
     assert v == 999
-    assert c.get("compute") == 999
\ No newline at end of file
+    assert c.get("compute") == 999
+
+def test_cache_write_behind(tmp_path):
+    path = tmp_path / "wb.json"
+    c = SimpleCache(path=path, write_behind=True, flush_interval=60, flush_after=0)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.delete("a")
+    # nothing written yet: mutations are only marked dirty
+    assert not path.exists()
+    c.flush()
+    assert SimpleCache(path=path).keys() == ["b"]
+    # threshold triggers the background flusher
+    c2 = SimpleCache(path=path, write_behind=True, flush_interval=60, flush_after=2)
+    c2.set("c", 3)
+    c2.set("d", 4)
+    deadline = time.time() + 5
+    while c2._dirty and time.time() < deadline:
+        time.sleep(0.01)
+    assert SimpleCache(path=path).get("d") == 4
+    c2.set("e", 5)
+    c2.close()
+    assert SimpleCache(path=path).get("e") == 5
+
+
+def test_cache_lru_eviction_and_expiry_heap(tmp_path):
+    c = SimpleCache(path=tmp_path / "lru.json", max_entries=3)
+    c.set("a", 1); c.set("b", 2); c.set("c", 3)
+    # touching "a" makes "b" the least recently used entry
+    assert c.get("a") == 1
+    c.set("d", 4)
+    assert sorted(c.keys()) == ["a", "c", "d"]
+    # overwriting a key with a longer ttl leaves a stale heap entry that must be ignored
+    c.set("t", "short", ttl=0.1)
+    c.set("t", "long", ttl=60)
+    time.sleep(0.15)
+    assert c.get("t") == "long"
+    # eviction order survives a reload
+    c2 = SimpleCache(path=tmp_path / "lru.json", max_entries=3)
+    c2.set("e", 5)
+    assert "t" in c2.keys() and "e" in c2.keys()
+
+
+def test_cache_journal_storage(tmp_path):
+    path = tmp_path / "j.json"
+    log = tmp_path / "j.json.log"
+    c = SimpleCache(path=path, storage="journal")
+    c.set("a", 1)
+    c.set("b", {"x": [1, 2]})
+    c.delete("a")
+    c.set("c", 3)
+    # only the log is written; the snapshot appears on compaction
+    assert log.exists() and not path.exists()
+    # simulate a crash in the middle of appending a record
+    with open(log, "ab") as f:
+        f.write(b'{"op":"set","k":"d","e":{"val')
+    c2 = SimpleCache(path=path, storage="journal")
+    assert sorted(c2.keys()) == ["b", "c"]
+    assert c2.get("b") == {"x": [1, 2]}
+    assert log.read_bytes().endswith(b"\n")
+    c2.set("e", 5)
+    c2.compact()
+    assert path.exists() and not log.exists()
+    c3 = SimpleCache(path=path, storage="journal")
+    assert sorted(c3.keys()) == ["b", "c", "e"]
+    # the snapshot stays readable by the plain json storage
+    assert SimpleCache(path=path).get("e") == 5
+
+    # a second interrupted compaction keeps the records of the first one
+    path = tmp_path / "i.json"
+    log = tmp_path / "i.json.log"
+    c = SimpleCache(path=path, storage="journal")
+    c.set("old", 1)
+    os.replace(log, tmp_path / "i.json.log.1")  # crashed right after rotating
+    c = SimpleCache(path=path, storage="journal")
+    c.set("new", 2)
+
+    def crash(data):
+        raise OSError("crashed before the snapshot was written")
+
+    c._atomic_write = crash
+    with pytest.raises(OSError):
+        c.compact()
+    assert sorted(SimpleCache(path=path, storage="journal").keys()) == ["new", "old"]
+
+    # with another codec the log records keep its types too
+    import datetime
+    path = tmp_path / "p.cache"
+    c = SimpleCache(path=path, storage="journal", codec="pickle")
+    c.set("t", (1, 2))
+    c.set("d", datetime.date(2024, 5, 1))
+    log = tmp_path / "p.cache.log"
+    size = log.stat().st_size
+    with open(log, "ab") as f:
+        f.write(b"\x00\x00\x00\x01\x00torn")
+    c2 = SimpleCache(path=path, storage="journal", codec="pickle")
+    assert c2.get("t") == (1, 2) and c2.get("d") == datetime.date(2024, 5, 1)
+    assert log.stat().st_size == size
+
+
+def test_sharded_cache_threads(tmp_path):
+    c = ShardedCache(path=tmp_path / "s.json", shards=4, max_entries=1000)
+
+    def worker(n):
+        for i in range(50):
+            c.set(f"t{n}-{i}", i)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert c.size() == 200
+    # keys land in several shard files, each with its own lock
+    assert len(list(tmp_path.glob("s.shard*.json"))) == 4
+    assert len({id(s._lock) for s in c._shards}) == 4
+    c2 = ShardedCache(path=tmp_path / "s.json", shards=4, max_entries=1000)
+    assert c2.get("t3-49") == 49
+    assert c2.delete("t3-49") and c2.get("t3-49") is None
+
+
+def test_cache_interprocess_merge(tmp_path):
+    path = tmp_path / "shared.json"
+    a = SimpleCache(path=path, interprocess=True)
+    b = SimpleCache(path=path, interprocess=True)
+    a.set("x", 1)
+    b.set("y", 2)  # must not drop "x" written by the other instance
+    a.set("z", 3)
+    assert sorted(a.keys()) == ["x", "y", "z"]
+    assert b.get("z") == 3  # file changed -> b re-reads
+    b.delete("x")
+    assert a.get("x") is None
+    # the newer update of a key wins
+    a.set("y", "a")
+    b.set("y", "b")
+    assert a.get("y") == "b"
+
+    # several processes writing distinct keys lose nothing
+    script = (
+        "import sys; sys.path.insert(0, sys.argv[1]); from cache import SimpleCache; "
+        "c = SimpleCache(path=sys.argv[2], interprocess=True); "
+        "[c.set(f'{sys.argv[3]}-{i}', i) for i in range(20)]"
+    )
+    root = str(Path(__file__).parents[1])
+    procs = [subprocess.Popen([sys.executable, "-c", script, root, str(path), f"p{n}"]) for n in range(4)]
+    assert all(p.wait() == 0 for p in procs)
+    assert len([k for k in SimpleCache(path=path).keys() if k.startswith("p")]) == 80
+
+
+def test_cache_write_retries_replace_while_file_is_open(tmp_path, monkeypatch):
+    path = tmp_path / "shared.json"
+    c = SimpleCache(path=path, interprocess=True)
+    c.set("a", 1)
+    real_replace = os.replace
+    attempts = []
+
+    def busy_replace(src, dst):
+        # what Windows does while another process's _refresh has dst open
+        attempts.append(dst)
+        if len(attempts) < 3:
+            raise PermissionError(13, "The process cannot access the file", dst)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", busy_replace)
+    c.set("b", 2)
+    assert len(attempts) == 3
+    monkeypatch.setattr(os, "replace", real_replace)
+    assert SimpleCache(path=path, interprocess=True).keys() == ["a", "b"]
+
+
+def test_get_or_compute_single_flight(tmp_path):
+    c = SimpleCache(path=tmp_path / "sf.json")
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "v"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(c.get_or_compute("k", slow))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["v"] * 8 and len(calls) == 1
+    # a thread that missed just before the leader landed uses its result instead of computing again
+    real_lookup = c._lookup
+    landed = threading.Event()
+
+    def late_lookup(key):
+        found = real_lookup(key)
+        if threading.current_thread().name == "late":
+            landed.wait(5)
+        return found
+
+    c._lookup = late_lookup
+    calls.clear()
+    late = threading.Thread(target=lambda: results.append(c.get_or_compute("r", lambda: calls.append(1) or "r")),
+                            name="late")
+    late.start()
+    time.sleep(0.05)
+    assert c.get_or_compute("r", lambda: calls.append(1) or "r") == "r"
+    landed.set()
+    late.join()
+    c._lookup = real_lookup
+    assert results[-1] == "r" and len(calls) == 1
+    # a cached None is a hit
+    nones = []
+    assert c.get_or_compute("n", lambda: nones.append(1)) is None
+    assert c.get_or_compute("n", lambda: nones.append(1)) is None
+    assert len(nones) == 1
+
+    # failures are cached for negative_ttl
+    def boom():
+        calls.append(1)
+        raise ValueError("nope")
+
+    calls.clear()
+    raised = []
+    for _ in range(50):
+        with pytest.raises(ValueError) as exc:
+            c.get_or_compute("bad", boom, negative_ttl=60)
+        raised.append(exc.value)
+    assert len(calls) == 1
+    # every caller gets its own instance; the stored one's traceback does not grow
+    assert len({id(e) for e in raised}) == 50
+    stored = raised[0].__cause__
+    assert all(e.__cause__ is stored for e in raised)
+    depth = 0
+    tb = stored.__traceback__
+    while tb:
+        depth, tb = depth + 1, tb.tb_next
+    assert depth < 5
+
+    # stale-while-revalidate serves the old value and refreshes once in the background
+    c.get_or_compute("s2", lambda: "old", ttl=0.1, stale_ttl=60)
+    time.sleep(0.15)
+    assert c.get("s2") is None  # plain get() does not serve stale values
+    assert c.get_or_compute("s2", lambda: "new", ttl=60, stale_ttl=60) == "old"
+    deadline = time.time() + 5
+    while c.get("s2") != "new" and time.time() < deadline:
+        time.sleep(0.01)
+    assert c.get("s2") == "new"
+
+
+def test_cache_codecs(tmp_path):
+    legacy = tmp_path / "legacy.json"
+    legacy.write_text('{"old": {"value": 1, "expires": null, "updated": 0}}', encoding="utf-8")
+    for name in ["json", "json-compact", "pickle", "marshal", "zlib-json-compact", "zlib-pickle"]:
+        path = tmp_path / f"{name}.cache"
+        c = SimpleCache(path=path, codec=name)
+        c.set("k", {"a": [1, 2]})
+        raw = path.read_bytes()
+        assert raw.startswith(b"{") if name == "json" else raw.startswith(b"PYNC1 " + name.encode() + b"\n")
+        assert SimpleCache(path=path, codec=name).get("k") == {"a": [1, 2]}
+        # the header decides how a file is read, but only JSON-based data loads in a cache
+        # that did not opt into the codec: unpickling an untrusted file could run code
+        expected = None if name in ("pickle", "marshal", "zlib-pickle") else {"a": [1, 2]}
+        assert SimpleCache(path=path).get("k") == expected
+        # headerless files from older versions still load
+        assert SimpleCache(path=legacy, codec=name).get("old") == 1
+    # pickle keeps non-JSON values intact
+    c = SimpleCache(path=tmp_path / "p.cache", codec="pickle")
+    c.set("t", (1, 2))
+    assert SimpleCache(path=tmp_path / "p.cache", codec="pickle").get("t") == (1, 2)
+
+
+def test_cache_max_bytes(tmp_path):
+    path = tmp_path / "b.json"
+    c = SimpleCache(path=path, max_entries=0, max_bytes=4000)
+    c.set("flag", True)
+    for i in range(10):
+        c.set(f"tpl{i}", "x" * 1000)
+    st = c.stats()
+    assert st["bytes"] <= 4000 and st["entries"] < 11
+    # least recently used entries went first
+    assert c.get("tpl9") is not None and c.get("tpl0") is None and c.get("flag") is None
+    assert st["file_bytes"] == path.stat().st_size
+    c.delete("tpl9")
+    assert c.stats()["bytes"] == st["bytes"] - (len("tpl9") + 1002 + 64)
+    # accounting is rebuilt on load
+    assert SimpleCache(path=path, max_entries=0, max_bytes=4000).stats()["bytes"] == c.stats()["bytes"]
+    # values only the pickle codec can hold are sized too, and ignored without max_bytes
+    for max_bytes in (None, 4000):
+        p = tmp_path / f"p{max_bytes}.cache"
+        c = SimpleCache(path=p, codec="pickle", max_bytes=max_bytes)
+        c.set("tuple-keys", {(1, 2): "x"})
+        c.set("a-set", {1, 2, 3})
+        reloaded = SimpleCache(path=p, codec="pickle", max_bytes=max_bytes)
+        assert reloaded.get("tuple-keys") == {(1, 2): "x"} and reloaded.get("a-set") == {1, 2, 3}
+        assert (reloaded.stats()["bytes"] is None) == (max_bytes is None)
+
+
+def test_async_cache(tmp_path):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "v"
+
+    async def main():
+        ac = AsyncCache(SimpleCache(path=tmp_path / "a.json"))
+        await ac.aset("x", 1)
+        assert await ac.aget("x") == 1
+        results = await asyncio.gather(*[ac.aget_or_compute("k", compute) for _ in range(10)])
+        assert results == ["v"] * 10 and len(calls) == 1
+        assert await ac.aget_or_compute("k", compute) == "v" and len(calls) == 1
+        assert await ac.aget_or_compute("sync", lambda: None) is None
+        assert await ac.adelete("x")
+        # write-behind caches are served in memory and flushed on demand
+        wb = AsyncCache(SimpleCache(path=tmp_path / "wb.json", write_behind=True, flush_interval=60, flush_after=0))
+        await wb.aset("y", 2)
+        await wb.aflush()
+        assert wb._in_memory()
+        # journal caches do disk I/O under their lock, so they are not served on the loop
+        jc = SimpleCache(path=tmp_path / "j.json", storage="journal", write_behind=True, flush_interval=60)
+        jc.size()
+        assert not AsyncCache(jc)._in_memory()
+        # a plain fn runs in the executor, not on the loop thread
+        loop_thread = threading.get_ident()
+        assert await wb.aget_or_compute("tid", threading.get_ident) != loop_thread
+        # a cancelled first caller does not cancel the computation the others wait on
+        slow = asyncio.ensure_future(ac.aget_or_compute("c", compute))
+        follower = asyncio.ensure_future(ac.aget_or_compute("c", compute))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(slow, 0.01)
+        assert await follower == "v" and len(calls) == 2
+
+    asyncio.run(main())
+    assert SimpleCache(path=tmp_path / "a.json").get("k") == "v"
+    assert SimpleCache(path=tmp_path / "wb.json").get("y") == 2
+
+
+def test_cache_metrics(tmp_path):
+    dump = tmp_path / "metrics.jsonl"
+    c = SimpleCache(path=tmp_path / "m.json", max_entries=2, metrics=True, metrics_dump=dump, metrics_interval=60)
+    c.set("a", 1); c.set("b", 2); c.set("c", 3)  # evicts "a"
+    c.get("b"); c.get("a")
+    c.get_or_compute("d", lambda: 4)
+    m = c.stats()["metrics"]
+    assert (m["hits"], m["misses"], m["evictions"], m["computes"]) == (1, 2, 2, 1)
+    assert m["bytes_written"] > 0
+    assert m["latency"]["save"]["count"] == 4 and m["latency"]["atomic_write"]["count"] == 4
+    assert m["latency"]["load"]["count"] == 1
+    c.close()
+    line = json.loads(dump.read_text(encoding="utf-8").splitlines()[-1])
+    assert line["metrics"]["computes"] == 1
+    # metrics are off by default
+    assert "metrics" not in SimpleCache(path=tmp_path / "m.json").stats()
+
+
+@pytest.mark.parametrize("kw", [{}, {"storage": "journal"}, {"interprocess": True}])
+def test_cache_failed_flush_is_retried(tmp_path, kw):
+    path = tmp_path / "c.json"
+    c = SimpleCache(path=path, write_behind=True, flush_interval=3600, flush_after=0, **kw)
+    c.set("x", 1)
+    real = (c._append_journal_locked, c._atomic_write)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    c._append_journal_locked = c._atomic_write = fail
+    with pytest.raises(OSError):
+        c.flush()
+    assert c._dirty
+    c._append_journal_locked, c._atomic_write = real
+    c.flush()
+    assert c._dirty == 0
+    c.close()
+    assert SimpleCache(path=path, **kw).get("x") == 1
@@ -26,4 +26,23 @@ def test_gui_autofill_and_render(tmp_path):
     content = gui.preview.get("1.0", "end")
     assert "Hello" in content
 
-    gui.destroy()
\ No newline at end of file
+    gui.destroy()
+
+def test_gui_help_dialog_reports_render_errors(tmp_path, monkeypatch):
+    pytest.importorskip("tkinter")
+    import gui as gui_mod
+    tm = TemplatesManager(tmp_path / "templates")
+    tm.save_template("broken.py", "#% include missing.py\n${name}\n")
+
+    gui = PythonNewGUI(str(tmp_path))
+    gui.withdraw()
+    gui.tm = tm
+    gui._populate_list(tm.list_templates())
+    gui._select_template_by_name("broken.py")
+
+    shown = []
+    monkeypatch.setattr(gui_mod.messagebox, "showinfo", lambda title, text: shown.append(text))
+    gui._show_helper_dialog()
+    assert len(shown) == 1 and "Cannot render broken.py" in shown[0]
+
+    gui.destroy()
@@ -0,0 +1,41 @@
+import errno
+import sys
+import types
+
+import pytest
+
+import locking
+from locking import FileLock
+
+
+def _fake_msvcrt(errors):
+    """msvcrt stand-in whose locking() raises the given errnos, then succeeds."""
+    calls = []
+
+    def fake_locking(fd, mode, nbytes):
+        calls.append(mode)
+        if mode == "lock" and errors:
+            raise OSError(errors.pop(0), "locking failed")
+
+    return types.SimpleNamespace(LK_LOCK="lock", LK_UNLCK="unlock", locking=fake_locking), calls
+
+
+def test_windows_lock_retries_only_while_busy(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(locking.os, "name", "nt")
+    monkeypatch.setattr(locking.time, "sleep", sleeps.append)
+
+    # contention: wait and try again
+    busy = getattr(errno, "EDEADLOCK", errno.EDEADLK)
+    msvcrt, calls = _fake_msvcrt([busy, errno.EACCES])
+    monkeypatch.setitem(sys.modules, "msvcrt", msvcrt)
+    with FileLock(tmp_path / "a.lock"):
+        pass
+    assert calls == ["lock", "lock", "lock", "unlock"] and len(sleeps) == 2
+
+    # anything else is an error, not a reason to spin
+    msvcrt, calls = _fake_msvcrt([errno.EBADF])
+    monkeypatch.setitem(sys.modules, "msvcrt", msvcrt)
+    with pytest.raises(OSError) as exc:
+        FileLock(tmp_path / "b.lock").acquire()
+    assert exc.value.errno == errno.EBADF and calls == ["lock"]
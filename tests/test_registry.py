@@ -0,0 +1,239 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+import registry
+import setup_newfile
+
+
+def test_cached_reads_revalidate_with_stat(tmp_path, monkeypatch):
+    path = str(tmp_path / "registry.json")
+    registry.set("author", "Ann", path=path)
+    registry.update_registry({"recent": ["a.py"]}, path=path)
+    loads = []
+    real_load = json.load
+    monkeypatch.setattr(json, "load", lambda f: loads.append(1) or real_load(f))
+    for _ in range(10):
+        assert registry.get("author", path=path) == "Ann"
+    assert registry.load_registry(path) == {"author": "Ann", "recent": ["a.py"]}
+    registry.set("last_template", "t.py", path=path)
+    assert registry.get("last_template", path=path) == "t.py"
+    assert loads == []
+    # callers cannot corrupt the cached copy
+    registry.get("recent", path=path).append("b.py")
+    registry.load_registry(path)["author"] = "Bob"
+    assert registry.load_registry(path) == {"author": "Ann", "recent": ["a.py"], "last_template": "t.py"}
+    # another process replacing the file is noticed through os.stat
+    other = str(tmp_path / "other.json")
+    with open(other, "w", encoding="utf-8") as f:
+        json.dump({"author": "Eve"}, f)
+    os.replace(other, path)
+    assert registry.get("author", path=path) == "Eve" and loads == [1]
+    assert registry.delete("author", path=path) and registry.get("author", path=path) is None
+    os.remove(path)
+    assert registry.load_registry(path) == {}
+
+
+def test_transaction_batches_writes(tmp_path, monkeypatch):
+    path = str(tmp_path / "registry.json")
+    registry.set("keep", 1, path=path)
+    writes = []
+    real_write = registry._write
+    monkeypatch.setattr(registry, "_write", lambda p, data: writes.append(dict(data)) or real_write(p, data))
+    with registry.transaction(path) as reg:
+        reg["a"] = 1
+        registry.set("b", 2, path=path)
+        assert registry.get("a", path=path) == 1
+        with registry.transaction(path) as inner:
+            assert inner is reg
+            registry.update_registry({"c": 3}, path=path)
+            assert registry.delete("keep", path=path)
+        assert writes == []
+    assert writes == [{"a": 1, "b": 2, "c": 3}]
+    assert registry.load_registry(path) == {"a": 1, "b": 2, "c": 3}
+    # no changes, no write; an exception discards the snapshot
+    with registry.transaction(path) as reg:
+        registry.set("a", 1, path=path)
+    with pytest.raises(RuntimeError):
+        with registry.transaction(path):
+            registry.set("a", 99, path=path)
+            raise RuntimeError
+    assert len(writes) == 1 and registry.get("a", path=path) == 1
+
+
+def test_registry_writer_debounces(tmp_path, monkeypatch):
+    path = str(tmp_path / "registry.json")
+    writes = []
+    real_update = registry.update_registry
+    monkeypatch.setattr(registry, "update_registry", lambda u, p=None: writes.append(dict(u)) or real_update(u, p))
+    w = registry.RegistryWriter(path, delay=0.05)
+    for i in range(20):
+        w.post({"last_template": f"t{i}.py"})
+    w.post({"last_target": "/tmp"})
+    assert writes == []
+    deadline = time.time() + 5
+    while not writes and time.time() < deadline:
+        time.sleep(0.01)
+    assert writes == [{"last_template": "t19.py", "last_target": "/tmp"}]
+    # close flushes what is still pending
+    w.post({"last_created": "x.py"})
+    w.close()
+    assert registry.load_registry(path) == {"last_template": "t19.py", "last_target": "/tmp", "last_created": "x.py"}
+    assert len(writes) == 2
+
+
+def test_registry_writer_flushes_during_sustained_posts(tmp_path, monkeypatch):
+    writes = []
+    monkeypatch.setattr(registry, "update_registry", lambda u, p=None: writes.append(time.monotonic()))
+    w = registry.RegistryWriter(str(tmp_path / "registry.json"), delay=0.05, max_wait=0.2)
+    start = time.monotonic()
+    while time.monotonic() - start < 0.7:
+        w.post({"last_template": str(time.monotonic())})
+        time.sleep(0.01)
+    # posts never paused for `delay`, yet max_wait forced writes along the way
+    assert len(writes) >= 2 and writes[0] - start < 0.4
+    w.close()
+
+
+def test_registry_writer_backs_off_after_failures(tmp_path, monkeypatch):
+    attempts = []
+
+    def failing_update(updates, path=None):
+        attempts.append(time.monotonic())
+        raise PermissionError("read-only profile")
+
+    monkeypatch.setattr(registry, "update_registry", failing_update)
+    w = registry.RegistryWriter(str(tmp_path / "registry.json"), delay=0.01)
+    w.post({"last_template": "a.py"})
+    time.sleep(0.5)
+    # 0.01 s doubling per failure: about six attempts in half a second, not a busy loop
+    assert 1 <= len(attempts) <= 10
+    assert all(b - a >= 0.01 for a, b in zip(attempts, attempts[1:]))
+    with pytest.raises(PermissionError):
+        w.close()
+    assert w._pending == {"last_template": "a.py"}
+
+
+def test_concurrent_processes_lose_no_updates(tmp_path):
+    path = tmp_path / "registry.json"
+    script = (
+        "import sys; sys.path.insert(0, sys.argv[1]); import registry; "
+        "[registry.update_registry({f'{sys.argv[3]}-{i}': i}, sys.argv[2]) for i in range(25)]"
+    )
+    root = str(Path(__file__).parents[1])
+    procs = [subprocess.Popen([sys.executable, "-c", script, root, str(path), f"p{n}"]) for n in range(6)]
+    assert all(p.wait() == 0 for p in procs)
+    assert len(registry.load_registry(str(path))) == 150
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+class _FakeWinreg:
+    """In-memory stand-in for winreg that records every call."""
+
+    HKEY_CURRENT_USER = "HKCU"
+    HKEY_CLASSES_ROOT = "HKCR"
+    REG_SZ = 1
+
+    def __init__(self):
+        self.keys = {}
+        self.calls = []
+
+    def OpenKey(self, root, path):
+        self.calls.append("OpenKey")
+        if (root, path.lower()) not in self.keys:
+            raise FileNotFoundError(path)
+        return (root, path.lower())
+
+    def CreateKey(self, root, path):
+        self.calls.append("CreateKey")
+        self.keys.setdefault((root, path.lower()), {})
+        return (root, path.lower())
+
+    def QueryValueEx(self, key, name):
+        self.calls.append("QueryValueEx")
+        if name not in self.keys[key]:
+            raise FileNotFoundError(name)
+        return self.keys[key][name], self.REG_SZ
+
+    def SetValueEx(self, key, name, reserved, kind, value):
+        self.calls.append("SetValueEx")
+        self.keys[key][name] = value
+
+    def DeleteKey(self, root, path):
+        self.calls.append("DeleteKey")
+        if self.keys.pop((root, path.lower()), None) is None:
+            raise FileNotFoundError(path)
+
+    def CloseKey(self, key):
+        self.calls.append("CloseKey")
+
+
+def test_shell_state_applies_only_differences():
+    fake = _FakeWinreg()
+    desired = registry.desired_shell_state("user", "system", script_path="/opt/create_python_new.py")
+    assert registry.apply_shell_state(desired, winreg_module=fake) == (True, "4 change(s) applied")
+    assert registry.shell_status(fake) == {
+        "background": (True, "HKCU"), "shellnew": (True, "HKCR"), "shellnew_file": "NeuePythonDatei.py"}
+
+    # a second apply only reads; a changed value is the only write
+    fake.calls.clear()
+    assert registry.plan_shell_state(desired, winreg_module=fake) == []
+    assert registry.apply_shell_state(desired, winreg_module=fake) == (True, "Already up to date")
+    assert "SetValueEx" not in fake.calls and "CreateKey" not in fake.calls
+    assert fake.calls.count("OpenKey") == fake.calls.count("CloseKey")
+    desired = registry.desired_shell_state(None, "system", file_name="Other.py")
+    fake.calls.clear()
+    assert registry.apply_shell_state(desired, winreg_module=fake)[0]
+    assert fake.calls.count("SetValueEx") == 1
+
+    # None marks keys to remove, subkeys first
+    path = r"Software\Classes\Directory\Background\shell\NeuePythonDatei"
+    remove = {("HKCU", path): None, ("HKCU", path + r"\command"): None}
+    assert registry.plan_shell_state(remove, fake) == [("delete", "HKCU", path + r"\command"), ("delete", "HKCU", path)]
+    assert registry.apply_shell_state(remove, fake)[0]
+    assert registry.check_entry_background(fake) == (False, None)
+
+
+def test_install_applies_entries_independently(tmp_path, monkeypatch):
+
+    class _NoAdminWinreg(_FakeWinreg):
+        def CreateKey(self, root, path):
+            if root == self.HKEY_CLASSES_ROOT:
+                raise PermissionError(path)
+            return super().CreateKey(root, path)
+
+    fake = _NoAdminWinreg()
+    monkeypatch.setattr(registry, "_get_winreg", lambda winreg_module: winreg_module or fake)
+    monkeypatch.setattr(registry, "get_python_new_path", lambda: "/opt/create_python_new.py")
+    ok, _ = setup_newfile.install(tmp_path / "install", background_hive="system", shellnew_hive="user")
+    assert ok
+    status = registry.shell_status()
+    assert status["background"] == (False, None)
+    assert status["shellnew"] == (True, "HKCU")
+
+
+def test_write_retries_replace_while_file_is_open(tmp_path, monkeypatch):
+    path = str(tmp_path / "registry.json")
+    registry.set("a", 1, path=path)
+    real_replace = os.replace
+    attempts = []
+
+    def busy_replace(src, dst):
+        # what Windows does while a reader has dst open
+        attempts.append(dst)
+        if len(attempts) < 3:
+            raise PermissionError(13, "The process cannot access the file", dst)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", busy_replace)
+    registry.set("b", 2, path=path)
+    assert len(attempts) == 3
+    monkeypatch.setattr(os, "replace", real_replace)
+    registry._cache.clear()
+    assert registry.load_registry(path) == {"a": 1, "b": 2}
+    assert not list(tmp_path.glob("*.tmp"))
@@ -1,6 +1,7 @@
 import json
+import pytest
 from pathlib import Path
-from templates import TemplatesManager, random_name
+from templates import TemplateCycleError, TemplatesManager, random_name
 import tempfile
 
 def test_templates_crud_and_render(tmp_path):
@@ -25,31 +26,294 @@ def test_templates_crud_and_render(tmp_path):
     assert "t1.py" not in tm.list_templates()
     # delete
     assert tm.delete_template("t2.py")
-    assert "t2.py" not in tm.list_templates()import json
-from pathlib import Path
-from templates import TemplatesManager, random_name
-import tempfile
+    assert "t2.py" not in tm.list_templates()
 
-def test_templates_crud_and_render(tmp_path):
+
+def test_render_uses_compiled_cache(tmp_path, monkeypatch):
+    tm = TemplatesManager(tmp_path / "templates")
+    tm.save_template("c.py", "A ${x}")
+    reads = []
+    real_read = Path.read_text
+    monkeypatch.setattr(Path, "read_text", lambda self, *a, **kw: reads.append(self.name) or real_read(self, *a, **kw))
+    for _ in range(5):
+        assert tm.render_template("c.py", {"x": "1"}) == "A 1"
+    assert reads.count("c.py") == 1
+    # writes through the manager invalidate, even when mtime/size would not change
+    tm.save_template("c.py", "B ${x}")
+    assert tm.render_template("c.py", {"x": "1"}) == "B 1"
+    # an outside edit is picked up through (mtime, size)
+    (tmp_path / "templates" / "c.py").write_text("Changed ${x}", encoding="utf-8")
+    assert tm.render_template("c.py", {"x": "1"}) == "Changed 1"
+    tm.rename_template("c.py", "d.py")
+    assert tm.render_template("c.py") == "" and tm.render_template("d.py", {"x": "2"}) == "Changed 2"
+    tm.delete_template("d.py")
+    assert tm.render_template("d.py") == ""
+
+
+def test_render_dependency_order_and_cycles(tmp_path):
+    tm = TemplatesManager(tmp_path / "templates")
+    tm.save_template("deep.py", "${v50} ${missing}")
+    # a chain deeper than the old 10-pass limit resolves fully
+    chain = {"v0": "x"}
+    chain.update({f"v{i}": f"${{v{i - 1}}}" for i in range(1, 51)})
+    assert tm.render_template("deep.py", chain) == "x ${missing}"
+    # cycles are reported with the keys involved, not silently truncated
+    with pytest.raises(TemplateCycleError) as exc:
+        tm.render_template("deep.py", {"v50": "${a}", "a": "${b}", "b": "$a", "c": "${a}"})
+    assert sorted(exc.value.keys) == ["a", "b"]
+
+
+def test_render_dollar_escapes_once(tmp_path):
+    from string import Template
+    tm = TemplatesManager(tmp_path / "templates")
+    # "$$" is unescaped in a single pass, exactly as string.Template does,
+    # in template content and in variable values alike
+    for content, vars, expected in [
+        ("$$name", {"name": "X"}, "$name"),
+        ("$$$$", {}, "$$"),
+        ("${a}", {"a": "cost $$5"}, "cost $5"),
+        ("${a}", {"a": "$$b", "b": "B"}, "$b"),
+    ]:
+        tm.save_template("d.py", content)
+        assert tm.render_template("d.py", vars) == expected
+    for content in ["$$name", "$$$$", "a $$ b ${name}"]:
+        tm.save_template("d.py", content)
+        assert tm.render_template("d.py", {"name": "X"}) == Template(content).safe_substitute(name="X")
+
+
+def test_render_does_not_reparse_substituted_text(tmp_path):
+    tm = TemplatesManager(tmp_path / "templates")
+    # each value is expanded once from fully expanded references
+    # (the old repeated passes gave "$username" here)
+    tm.save_template("r.py", "${full}")
+    assert tm.render_template("r.py", {"full": "${first}name", "first": "$user", "user": "bob"}) == "bobname"
+    # a "$" produced by substitution does not start a new placeholder (the old passes gave "bob")
+    tm.save_template("r.py", "${open}{name}")
+    assert tm.render_template("r.py", {"open": "$", "name": "bob"}) == "${name}"
+
+
+def test_render_many(tmp_path):
+    tm = TemplatesManager(tmp_path / "templates")
+    tm.save_template("m.py", "${n}: ${label}")
+    var_sets = ({"n": i, "label": "item ${n}"} for i in range(50))
+    expected = [f"{i}: item {i}" for i in range(50)]
+    assert list(tm.render_many("m.py", var_sets, workers=2, chunk_size=7)) == expected
+    unordered = tm.render_many("m.py", ({"n": i, "label": "item ${n}"} for i in range(50)), workers=2,
+                               ordered=False, chunk_size=7)
+    assert sorted(unordered) == list(enumerate(expected))
+    assert list(tm.render_many("m.py", [{"n": 1}], workers=1)) == ["1: ${label}"]
+    # errors raised in a worker reach the caller intact
+    with pytest.raises(TemplateCycleError) as exc:
+        list(tm.render_many("m.py", [{"n": "${label}", "label": "${n}"}], workers=2))
+    assert sorted(exc.value.keys) == ["label", "n"]
+
+
+def test_render_to_streams_same_output(tmp_path):
+    import io
+    import templates
+    tm = TemplatesManager(tmp_path / "templates")
+    content = "".join(f"line {i}: ${{a}} $$b ${{b}} $$ $missing ${{c}}\n" for i in range(5000))
+    tm.save_template("big.py", content)
+    vars = {"a": "A", "b": "${a}+$$", "c": None}
+    expected = tm.render_template("big.py", vars)
+    buf = io.StringIO()
+    tm.render_to("big.py", vars, buf)
+    assert buf.getvalue() == expected
+    # small chunks split at every boundary still join to the same text
+    prepared = templates._prepare_vars(vars)
+    assert "".join(templates._render_chunks(content, templates.Template(content), prepared, 7)) == expected
+    dest = tmp_path / "out" / "gen.py"
+    tm.render_to("big.py", vars, dest)
+    assert dest.read_text(encoding="utf-8") == expected
+    # a failing render leaves an existing destination untouched and no temp files behind
+    with pytest.raises(TemplateCycleError):
+        tm.render_to("big.py", {"a": "${b}", "b": "${a}"}, dest)
+    assert dest.read_text(encoding="utf-8") == expected
+    assert [p.name for p in dest.parent.iterdir()] == ["gen.py"]
+
+
+def test_template_index_incremental(tmp_path, monkeypatch):
+    import os
     td = tmp_path / "templates"
     tm = TemplatesManager(td)
-    # create
-    name = "t1.py"
-    content = "Hello ${who}"
-    tm.create_template(name, content, {"vars": ["who"], "description": "desc"})
-    assert name in tm.list_templates()
-    # render with variable
-    rendered = tm.render_template(name, {"who": "Alice"})
-    assert "Hello Alice" in rendered
-    # nested variable in value
-    tm.save_template("nested.py", "A: ${a} B: ${b}", metadata={"vars": ["a","b"]})
-    # b uses ${a}
-    out = tm.render_template("nested.py", {"a": "X", "b": "${a}Y"})
-    assert "B: XY" in out
-    # rename
-    tm.rename_template(name, "t2.py")
-    assert "t2.py" in tm.list_templates()
-    assert "t1.py" not in tm.list_templates()
-    # delete
-    assert tm.delete_template("t2.py")
-    assert "t2.py" not in tm.list_templates()
\ No newline at end of file
+    tm.save_template("a.py", "A", metadata={"description": "a"})
+    scans = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda p: scans.append(p) or real_scandir(p))
+    names = tm.list_templates()
+    for _ in range(20):
+        assert tm.list_templates() == names
+    # the manager's own writes keep the index current without re-listing
+    tm.save_template("b.py", "BB")
+    tm.rename_template("b.py", "c.py")
+    assert "c.py" in tm.list_templates() and "b.py" not in tm.list_templates()
+    assert scans == []
+    assert tm.index()["a.py"]["meta"] == {"description": "a"} and tm.index()["c.py"]["size"] == 2
+    # outside changes are noticed through the directory mtime
+    (td / "outside.py").write_text("x", encoding="utf-8")
+    st = td.stat()
+    os.utime(td, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert "outside.py" in tm.list_templates() and len(scans) == 1
+    # in-place edits do not touch the directory; refresh(force=True) re-stats
+    (td / "a.py").write_text("AAAA", encoding="utf-8")
+    assert tm.index()["a.py"]["size"] == 1
+    tm.refresh(force=True)
+    assert tm.index()["a.py"]["size"] == 4
+
+
+def test_batch_defers_metadata_writes(tmp_path, monkeypatch):
+    tm = TemplatesManager(tmp_path / "templates")
+    writes = []
+    real_write = tm._write_meta
+    monkeypatch.setattr(tm, "_write_meta", lambda: writes.append(1) or real_write())
+    with tm.batch():
+        for i in range(20):
+            tm.save_template(f"b{i}.py", "x", metadata={"i": i})
+        with tm.batch():
+            tm.rename_template("b0.py", "renamed.py")
+        assert writes == []
+    assert writes == [1]
+    with pytest.raises(RuntimeError):
+        with tm.batch():
+            tm.delete_template("b1.py")
+            raise RuntimeError("boom")
+    assert len(writes) == 2
+    meta = json.loads((tmp_path / "templates" / "templates.json").read_text(encoding="utf-8"))
+    assert meta["renamed.py"] == {"i": 0} and "b1.py" not in meta and meta["b19.py"] == {"i": 19}
+    assert not list((tmp_path / "templates").glob("*.tmp"))
+
+
+def test_sqlite_meta_store(tmp_path):
+    td = tmp_path / "templates"
+    TemplatesManager(td).save_template("j.py", "x", metadata={"from": "json"})
+    tm = TemplatesManager(td, meta_store="sqlite")
+    # seeded from templates.json on first use
+    assert tm.get_metadata("j.py") == {"from": "json"}
+    with tm.batch():
+        tm.create_template("s.py", "y", {"vars": ["a"]})
+        tm.rename_template("j.py", "k.py")
+    tm.delete_template("starter.py")
+    tm2 = TemplatesManager(td, meta_store="sqlite")
+    assert tm2.get_metadata("s.py") == {"vars": ["a"]}
+    assert tm2.load_template("k.py", with_meta=True) == ("x", {"from": "json"})
+    assert "j.py" not in tm2._meta and "starter.py" not in tm2._meta
+    with pytest.raises(ValueError):
+        TemplatesManager(td, meta_store="xml")
+
+
+def test_lazy_manager(tmp_path):
+    td = tmp_path / "templates"
+    tm = TemplatesManager(td, lazy=True)
+    # no I/O until first use, and no seeding unless asked
+    assert not td.exists()
+    assert tm.list_templates() == [] and td.is_dir()
+    assert tm.ensure_default_templates() is True
+    assert tm.ensure_default_templates() is False
+    assert "starter.py" in tm.list_templates()
+    tm2 = TemplatesManager(td, lazy=True)
+    tm2.preload()
+    assert tm2.get_metadata("starter.py")["description"] == "Simple starter script"
+
+
+def test_placeholder_index(tmp_path, monkeypatch):
+    import os
+    td = tmp_path / "templates"
+    tm = TemplatesManager(td)
+    tm.save_template("a.py", "${name} $author $$escaped ${name}", metadata={"vars": ["wrong"]})
+    tm.save_template("b.py", "${name} ${license}")
+    assert tm.template_vars("a.py") == ["name", "author"]
+    assert tm.templates_using("name") == ["a.py", "b.py", "demo_variables.py", "starter.py"]
+    assert tm.templates_using("license") == ["b.py", "demo_variables.py"]
+    # the index itself stays stat-only: a fresh manager reads no template for it
+    fresh = TemplatesManager(td)
+    reads = []
+    real_raw = fresh._raw_template
+    fresh._raw_template = lambda name: reads.append(name) or real_raw(name)
+    assert "vars" not in fresh.index()["a.py"] and reads == []
+    # later changes re-extract only the templates that changed
+    extracted = []
+    import templates
+    real_refs = templates._references
+    monkeypatch.setattr(templates, "_references", lambda text: extracted.append(text) or real_refs(text))
+    tm.save_template("b.py", "${author}")
+    tm.delete_template("a.py")
+    assert tm.templates_using("name") == ["demo_variables.py", "starter.py"]
+    assert tm.templates_using("author") == ["b.py", "demo_variables.py"]
+    (td / "c.py").write_text("$fresh", encoding="utf-8")
+    st = td.stat()
+    os.utime(td, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert tm.templates_using("fresh") == ["c.py"]
+    assert extracted == ["${author}", "$fresh"]
+
+
+def test_bundle_with_overlay(tmp_path):
+    import zipfile
+    from templates import pack_templates
+    src = TemplatesManager(tmp_path / "src")
+    src.save_template("packed.py", "packed ${name}", metadata={"vars": ["name"]})
+    bundle = pack_templates(tmp_path / "src", tmp_path / "templates.zip")
+    with zipfile.ZipFile(bundle) as zf:
+        assert all(i.compress_type == zipfile.ZIP_STORED for i in zf.infolist())
+    overlay = tmp_path / "overlay"
+    tm = TemplatesManager(overlay, bundle=bundle, lazy=True)
+    assert tm.list_templates() == ["demo_variables.py", "packed.py", "starter.py"]
+    assert list(overlay.iterdir()) == []
+    assert tm.render_template("packed.py", {"name": "X"}) == "packed X"
+    assert tm.get_metadata("packed.py") == {"vars": ["name"]} and tm.template_vars("packed.py") == ["name"]
+    assert tm.ensure_default_templates() is False
+    with pytest.raises(FileExistsError):
+        tm.create_template("packed.py", "dup")
+    # edits land in the overlay and shadow the bundle; deletes hide bundled templates
+    tm.save_template("packed.py", "edited ${name}")
+    assert tm.render_template("packed.py", {"name": "Y"}) == "edited Y"
+    tm.rename_template("starter.py", "mine.py")
+    assert tm.delete_template("demo_variables.py")
+    tm2 = TemplatesManager(overlay, bundle=bundle)
+    assert tm2.list_templates() == ["mine.py", "packed.py"]
+    assert tm2.load_template("mine.py").startswith("#!/usr/bin/env python3")
+    # deleting the overlay copy of an edited template hides the bundled one as well
+    assert tm2.delete_template("packed.py") and tm2.list_templates() == ["mine.py"]
+    # close() unmaps the bundle, so it can be re-packed in place (needed on Windows)
+    mapping = tm2._bundle._map
+    tm.close()
+    tm2.close()
+    assert mapping.closed
+    pack_templates(tmp_path / "src", bundle)
+    with TemplatesManager(overlay, bundle=bundle) as tm3:
+        assert tm3.list_templates() == ["mine.py"]
+
+
+def test_includes_and_extends(tmp_path, monkeypatch):
+    from templates import TemplateIncludeCycleError
+    tm = TemplatesManager(tmp_path / "templates")
+    tm.save_template("license.py", "# (c) ${author}\n")
+    tm.save_template("base.py", "#% include license.py\n#% block body\ndefault body\n#% endblock\n# end\n")
+    tm.save_template("child.py", "#% extends base.py\n#% block body\nprint('${name}')\n#% endblock\n")
+    tm.save_template("other.py", "#% include license.py\nother\n")
+    assert tm.render_template("child.py", {"author": "Ann", "name": "x"}) == "# (c) Ann\nprint('x')\n# end\n"
+    assert tm.render_template("base.py", {"author": "Ann"}) == "# (c) Ann\ndefault body\n# end\n"
+    assert tm.template_vars("child.py") == ["author", "name"]
+    # editing is on the raw text
+    assert tm.load_template("child.py").startswith("#% extends base.py")
+    # cached renders read nothing; a change recompiles only templates built from it
+    tm.render_template("other.py")
+    reads = []
+    real_read = Path.read_text
+    monkeypatch.setattr(Path, "read_text", lambda self, *a, **kw: reads.append(self.name) or real_read(self, *a, **kw))
+    tm.render_template("child.py")
+    tm.render_template("other.py")
+    assert reads == []
+    tm.save_template("base.py", "#% block body\n#% endblock\n== ${author}\n")
+    assert tm.render_template("other.py", {"author": "B"}) == "# (c) B\nother\n"
+    assert tm.render_template("child.py", {"author": "B", "name": "y"}) == "print('y')\n== B\n"
+    assert reads == ["base.py"]
+    # cycles and missing includes are reported
+    tm.save_template("loop_a.py", "#% include loop_b.py\n")
+    tm.save_template("loop_b.py", "#% extends loop_a.py\n")
+    with pytest.raises(TemplateIncludeCycleError) as exc:
+        tm.render_template("loop_a.py")
+    assert exc.value.keys == ["loop_a.py", "loop_b.py", "loop_a.py"]
+    tm.save_template("broken.py", "#% include nope.py\n")
+    with pytest.raises(FileNotFoundError):
+        tm.render_template("broken.py")
+    assert tm.template_vars("broken.py") == []
@@ -0,0 +1,189 @@
+"""
+Micro-benchmarks for cache.SimpleCache.
+
+Run from the repository root:
+
+    python tools/bench_cache.py                 # all scenarios
+    python tools/bench_cache.py ops --sizes 10000 100000 1000000
+
+Per-operation latencies are reported in microseconds.
+"""
+import argparse
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from cache import CODECS, ShardedCache, SimpleCache  # noqa: E402
+
+
+def _per_op_us(elapsed: float, n: int) -> float:
+    return elapsed / max(n, 1) * 1e6
+
+
+def bench_ops(args, ops: int = 20000) -> None:
+    """
+    Fill a cache to `size` entries (half of them with a TTL), then time `ops`
+    further sets (each forcing an LRU eviction) and gets. Uses write-behind
+    with no automatic flush so only the in-memory structure is measured.
+    """
+    print(f"{'entries':>10} {'fill us/op':>12} {'set us/op':>12} {'get us/op':>12}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as td:
+            c = SimpleCache(path=Path(td) / "bench.json", max_entries=size, metrics=args.metrics,
+                            write_behind=True, flush_interval=3600, flush_after=0)
+            t0 = time.perf_counter()
+            for i in range(size):
+                c.set(f"k{i}", i, ttl=3600 if i % 2 else None)
+            fill = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            for i in range(size, size + ops):
+                c.set(f"k{i}", i, ttl=3600 if i % 2 else None)
+            set_t = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            for i in range(ops):
+                c.get(f"k{size + i}")
+            get_t = time.perf_counter() - t0
+
+            print(f"{size:>10} {_per_op_us(fill, size):>12.2f} {_per_op_us(set_t, ops):>12.2f} "
+                  f"{_per_op_us(get_t, ops):>12.2f}")
+            # discard pending writes instead of serializing the whole cache on exit
+            c._dirty = 0
+            c.close()
+
+
+def _hammer(caches, threads: int, ops: int, keys: int) -> float:
+    """Run `threads` workers (90% get / 10% set) spread over caches; return ops/s."""
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(i: int) -> None:
+        c = caches[i % len(caches)]
+        rnd = random.Random(i)
+        barrier.wait()
+        for _ in range(ops):
+            k = f"k{rnd.randrange(keys)}"
+            if rnd.random() < 0.1:
+                c.set(k, "v" * 64)
+            else:
+                c.get(k)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for w in workers:
+        w.join()
+    return threads * ops / (time.perf_counter() - t0)
+
+
+def _prefilled(factory, keys: int):
+    """Write `keys` entries through a write-behind cache, then reopen it synchronously."""
+    c = factory(write_behind=True, flush_interval=3600, flush_after=0)
+    for i in range(keys):
+        c.set(f"k{i}", "v" * 64)
+    c.close()
+    c = factory()
+    c.size()  # load outside the timed section
+    return c
+
+
+class _GlobalLocked:
+    """A cache whose get/set (save included) run under one process-wide lock, like the old _LOCK."""
+
+    _LOCK = threading.RLock()
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, key):
+        with self._LOCK:
+            return self.cache.get(key)
+
+    def set(self, key, value):
+        with self._LOCK:
+            self.cache.set(key, value)
+
+
+def bench_threads(args, ops: int = 2000, keys: int = 2000) -> None:
+    """
+    Multi-threaded throughput with synchronous durability (every set persists).
+    "legacy" wraps every operation in one module-wide lock, as before
+    per-instance locks: one cache shared by all threads, and one cache per
+    thread (which still serialize on that lock). The others use today's
+    per-instance locks: one SimpleCache shared by all threads, a
+    ShardedCache(8) shared by all threads, and one SimpleCache per thread.
+    """
+    print(f"{'threads':>8} {'legacy shared':>14} {'legacy own':>11} {'shared':>9} {'sharded':>9} {'own':>9}  (ops/s)")
+    for threads in args.threads:
+        with tempfile.TemporaryDirectory() as td:
+            td = Path(td)
+
+            def simple(name):
+                return _prefilled(lambda **kw: SimpleCache(path=td / name, max_entries=keys, **kw), keys)
+
+            shared = simple("shared.json")
+            sharded = _prefilled(
+                lambda **kw: ShardedCache(path=td / "sharded.json", shards=8, max_entries=keys, **kw), keys)
+            own = [simple(f"own{i}.json") for i in range(threads)]
+            results = [_hammer([_GlobalLocked(simple("legacy.json"))], threads, ops, keys),
+                       _hammer([_GlobalLocked(simple(f"legacy{i}.json")) for i in range(threads)], threads, ops, keys),
+                       _hammer([shared], threads, ops, keys),
+                       _hammer([sharded], threads, ops, keys),
+                       _hammer(own, threads, ops, keys)]
+            print(f"{threads:>8} {results[0]:>14.0f} {results[1]:>11.0f} {results[2]:>9.0f} "
+                  f"{results[3]:>9.0f} {results[4]:>9.0f}")
+
+
+def bench_codecs(args, entries: int = 500, repeat: int = 5) -> None:
+    """File size and save/load time per codec for a cache of rendered templates."""
+    template = Path(__file__).resolve().parents[1] / "templates" / "NeuePythonDatei.py"
+    body = template.read_text(encoding="utf-8") * 20
+    print(f"{'codec':>18} {'file bytes':>12} {'save ms':>10} {'load ms':>10}")
+    for name in sorted(CODECS):
+        with tempfile.TemporaryDirectory() as td:
+            path = Path(td) / "bench.json"
+            c = SimpleCache(path=path, max_entries=entries, codec=name)
+            for i in range(entries):
+                c._put_locked(f"tpl{i}.py", {"value": f"# {i}\n" + body, "expires": None, "updated": time.time()})
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                c._save()
+            save_t = (time.perf_counter() - t0) / repeat
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                SimpleCache(path=path, max_entries=entries).size()
+            load_t = (time.perf_counter() - t0) / repeat
+            print(f"{name:>18} {path.stat().st_size:>12} {save_t * 1e3:>10.2f} {load_t * 1e3:>10.2f}")
+
+
+SCENARIOS = {
+    "codecs": bench_codecs,
+    "ops": bench_ops,
+    "threads": bench_threads,
+}
+
+
+def _cli(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Benchmark cache.SimpleCache")
+    p.add_argument("scenario", nargs="?", choices=sorted(SCENARIOS), help="Scenario to run (default: all)")
+    p.add_argument("--sizes", nargs="+", type=int, default=[10000, 100000, 1000000],
+                   help="Cache sizes for the 'ops' scenario")
+    p.add_argument("--threads", nargs="+", type=int, default=[1, 2, 4, 8],
+                   help="Thread counts for the 'threads' scenario")
+    p.add_argument("--metrics", action="store_true", help="Enable SimpleCache metrics in the 'ops' scenario")
+    args = p.parse_args(argv)
+    for name in [args.scenario] if args.scenario else sorted(SCENARIOS):
+        print(f"== {name}")
+        SCENARIOS[name](args)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_cli())
@@ -0,0 +1,271 @@
+"""
+Micro-benchmarks for registry.py.
+
+Run from the repository root:
+
+    python tools/bench_registry.py              # all scenarios
+    python tools/bench_registry.py ops --keys 10 1000
+    python tools/bench_registry.py stress --procs 32 --ops 50 [--fsync] [--legacy]
+    python tools/bench_registry.py shell --latency 50
+
+Per-operation latencies are reported in microseconds.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import registry  # noqa: E402
+
+
+def _per_op_us(elapsed: float, n: int) -> float:
+    return elapsed / max(n, 1) * 1e6
+
+
+def _legacy_get(key, path):
+    """registry.get before the process-wide cache: open and parse on every call."""
+    with open(path, "r", encoding="utf-8") as f:
+        return (json.load(f) or {}).get(key)
+
+
+def bench_ops(args, ops: int = 2000) -> None:
+    """get / set latency on a registry with `keys` entries: uncached parse versus the cached view."""
+    print(f"{'keys':>8} {'legacy get us':>14} {'get us':>10} {'set us':>10}")
+    for keys in args.keys:
+        with tempfile.TemporaryDirectory() as td:
+            path = str(Path(td) / "registry.json")
+            registry.save_registry({f"k{i}": f"value {i}" for i in range(keys)}, path)
+            t0 = time.perf_counter()
+            for i in range(ops):
+                _legacy_get(f"k{i % keys}", path)
+            legacy = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            for i in range(ops):
+                registry.get(f"k{i % keys}", path=path)
+            get_t = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            for i in range(ops // 10):
+                registry.set("last_template", f"t{i}.py", path=path)
+            set_t = time.perf_counter() - t0
+            print(f"{keys:>8} {_per_op_us(legacy, ops):>14.1f} {_per_op_us(get_t, ops):>10.1f} "
+                  f"{_per_op_us(set_t, ops // 10):>10.1f}")
+
+
+def bench_transaction(args, sets: int = 10, rounds: int = 100) -> None:
+    """`sets` consecutive registry.set calls on their own versus inside one transaction."""
+    print(f"{'mode':>12} {'ms/round':>10}")
+    with tempfile.TemporaryDirectory() as td:
+        path = str(Path(td) / "registry.json")
+        registry.save_registry({f"k{i}": i for i in range(100)}, path)
+
+        def plain(r):
+            for i in range(sets):
+                registry.set(f"s{i}", r, path=path)
+
+        def batched(r):
+            with registry.transaction(path):
+                plain(r)
+
+        for label, fn in (("plain", plain), ("transaction", batched)):
+            t0 = time.perf_counter()
+            for r in range(rounds):
+                fn(r)
+            print(f"{label:>12} {(time.perf_counter() - t0) / rounds * 1e3:>10.2f}")
+
+
+def _legacy_update(updates, path):
+    """update_registry before locking: unlocked load/save through a shared temp file."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            reg = json.load(f) or {}
+    except (OSError, ValueError):
+        reg = {}
+    reg.update(updates)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(reg, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _stress_worker(path: str, worker: int, ops: int, fsync: bool, legacy: bool, start, results) -> None:
+    registry.FSYNC = fsync
+    start.wait()
+    errors = 0
+    for j in range(ops):
+        try:
+            if legacy:
+                _legacy_update({f"w{worker}_{j}": j}, path)
+            else:
+                registry.update_registry({f"w{worker}_{j}": j}, path)
+        except Exception:
+            errors += 1
+    results.put(errors)
+
+
+def bench_stress(args) -> None:
+    """
+    `--procs` processes each add `--ops` distinct keys with update_registry at
+    the same time; reports throughput, failed calls and keys missing at the end.
+    --legacy runs the old unlocked load/save for comparison.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as td:
+        path = str(Path(td) / "registry.json")
+        start = ctx.Event()
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_stress_worker, args=(path, w, args.ops, args.fsync, args.legacy, start, results))
+                 for w in range(args.procs)]
+        for proc in procs:
+            proc.start()
+        time.sleep(2.0)  # let every worker import and block on the start event
+        t0 = time.perf_counter()
+        start.set()
+        errors = sum(results.get() for _ in procs)
+        elapsed = time.perf_counter() - t0
+        for proc in procs:
+            proc.join()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                final = json.load(f)
+        except (OSError, ValueError):
+            final = {}
+        total = args.procs * args.ops
+        lost = total - sum(1 for w in range(args.procs) for j in range(args.ops) if f"w{w}_{j}" in final)
+        mode = "legacy" if args.legacy else ("locked+fsync" if args.fsync else "locked")
+        print(f"{'mode':>14} {'procs':>6} {'updates':>8} {'updates/s':>10} {'errors':>7} {'lost keys':>10}")
+        print(f"{mode:>14} {args.procs:>6} {total:>8} {total / elapsed:>10.0f} {errors:>7} {lost:>10}")
+
+
+class _FakeWinreg:
+    """In-memory winreg that busy-waits `latency` seconds per call and counts calls."""
+
+    HKEY_CURRENT_USER = "HKCU"
+    HKEY_CLASSES_ROOT = "HKCR"
+    REG_SZ = 1
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.keys = {}
+        self.calls = 0
+        self.writes = 0
+
+    def _call(self, write: bool = False) -> None:
+        self.calls += 1
+        self.writes += write
+        end = time.perf_counter() + self.latency
+        while time.perf_counter() < end:
+            pass
+
+    def OpenKey(self, root, path):
+        self._call()
+        if (root, path.lower()) not in self.keys:
+            raise FileNotFoundError(path)
+        return (root, path.lower())
+
+    def CreateKey(self, root, path):
+        self._call(write=True)
+        self.keys.setdefault((root, path.lower()), {})
+        return (root, path.lower())
+
+    def QueryValueEx(self, key, name):
+        self._call()
+        if name not in self.keys[key]:
+            raise FileNotFoundError(name)
+        return self.keys[key][name], self.REG_SZ
+
+    def SetValueEx(self, key, name, reserved, kind, value):
+        self._call(write=True)
+        self.keys[key][name] = value
+
+    def DeleteKey(self, root, path):
+        self._call(write=True)
+        if self.keys.pop((root, path.lower()), None) is None:
+            raise FileNotFoundError(path)
+
+    def CloseKey(self, key):
+        self._call()
+
+
+def _legacy_refresh_and_install(winreg, script_path: str) -> None:
+    """The per-function probes and unconditional writes used before the shell-state planner."""
+    bg = r"Software\Classes\Directory\Background\shell\NeuePythonDatei"
+    for root in (winreg.HKEY_CURRENT_USER, winreg.HKEY_CLASSES_ROOT):  # check_entry_background
+        try:
+            winreg.CloseKey(winreg.OpenKey(root, bg))
+            break
+        except OSError:
+            pass
+    for _ in range(2):  # check_shellnew_py, then the GUI's own FileName read
+        key = winreg.OpenKey(winreg.HKEY_CLASSES_ROOT, r".py\ShellNew")
+        winreg.QueryValueEx(key, "FileName")
+        winreg.CloseKey(key)
+    key = winreg.CreateKey(winreg.HKEY_CURRENT_USER, bg)  # create_entry_background
+    winreg.SetValueEx(key, "", 0, winreg.REG_SZ, "Neue Python-Datei erstellen…")
+    winreg.SetValueEx(key, "Icon", 0, winreg.REG_SZ, sys.executable)
+    winreg.CloseKey(key)
+    key = winreg.CreateKey(winreg.HKEY_CURRENT_USER, bg + r"\command")
+    winreg.SetValueEx(key, "", 0, winreg.REG_SZ, f'"{sys.executable}" "{script_path}" "%V"')
+    winreg.CloseKey(key)
+    key = winreg.CreateKey(winreg.HKEY_CLASSES_ROOT, r".py\ShellNew")  # create_shellnew_py
+    winreg.SetValueEx(key, "FileName", 0, winreg.REG_SZ, "NeuePythonDatei.py")
+    winreg.CloseKey(key)
+
+
+def bench_shell(args, repeat: int = 200) -> None:
+    """
+    Status refresh plus re-install on an already registered machine, with a
+    fake winreg costing `--latency` microseconds per call: the old
+    per-function probes and writes versus shell_status() and
+    apply_shell_state() sharing one WinregSession.
+    """
+    script_path = "/opt/PythonNew/create_python_new.py"
+    desired = registry.desired_shell_state("user", "system", script_path=script_path)
+    print(f"{'mode':>10} {'winreg calls':>13} {'writes':>7} {'us/refresh':>11}")
+    for mode in ("legacy", "planned"):
+        fake = _FakeWinreg(args.latency / 1e6)
+        registry.apply_shell_state(desired, winreg_module=fake)
+        fake.calls = fake.writes = 0
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            if mode == "legacy":
+                _legacy_refresh_and_install(fake, script_path)
+            else:
+                with registry.WinregSession(fake) as session:
+                    registry.shell_status(session=session)
+                    registry.apply_shell_state(desired, session=session)
+        elapsed = time.perf_counter() - t0
+        print(f"{mode:>10} {fake.calls / repeat:>13.0f} {fake.writes / repeat:>7.0f} "
+              f"{_per_op_us(elapsed, repeat):>11.0f}")
+
+SCENARIOS = {
+    "ops": bench_ops,
+    "shell": bench_shell,
+    "stress": bench_stress,
+    "transaction": bench_transaction,
+}
+
+
+def _cli(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Benchmark registry.py")
+    p.add_argument("scenario", nargs="?", choices=sorted(SCENARIOS), help="Scenario to run (default: all)")
+    p.add_argument("--keys", nargs="+", type=int, default=[10, 1000], help="Registry sizes for the 'ops' scenario")
+    p.add_argument("--procs", type=int, default=32, help="Writer processes for the 'stress' scenario")
+    p.add_argument("--ops", type=int, default=50, help="update_registry calls per process for 'stress'")
+    p.add_argument("--fsync", action="store_true", help="Set registry.FSYNC in the 'stress' workers")
+    p.add_argument("--legacy", action="store_true", help="Use the old unlocked update in the 'stress' workers")
+    p.add_argument("--latency", type=float, default=50.0, help="Simulated microseconds per winreg call for 'shell'")
+    args = p.parse_args(argv)
+    for name in [args.scenario] if args.scenario else sorted(SCENARIOS):
+        print(f"== {name}")
+        SCENARIOS[name](args)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_cli())
@@ -0,0 +1,282 @@
+"""
+Micro-benchmarks for templates.TemplatesManager.
+
+Run from the repository root:
+
+    python tools/bench_templates.py            # all scenarios
+    python tools/bench_templates.py expand
+    python tools/bench_templates.py many --count 50000 --workers 2 4 8
+    python tools/bench_templates.py bulk --templates 2000
+
+Times are reported in milliseconds per render, throughput in renders per second.
+"""
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from string import Template
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from templates import TemplatesManager, pack_templates  # noqa: E402
+
+
+def _legacy_render(content: str, vars: dict) -> str:
+    """The fixed-point expansion render_template used before dependency ordering."""
+    vars = dict(vars)
+    for _ in range(10):
+        changed = False
+        for k, v in list(vars.items()):
+            new_v = Template(v).safe_substitute(vars)
+            if new_v != v:
+                vars[k] = new_v
+                changed = True
+        if not changed:
+            break
+    current = content
+    for _ in range(10):
+        new = Template(current).safe_substitute(vars)
+        if new == current:
+            break
+        current = new
+    return current
+
+
+def _time_ms(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1e3
+
+
+def bench_expand(args) -> None:
+    """
+    Deep chains (v_i references v_{i-1}), declared leaf-first and leaf-last
+    (the legacy loop stops after 10 passes, so its output for long leaf-last
+    chains is truncated beyond that depth), and wide, mostly independent
+    variable sets referenced from a large template.
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tm = TemplatesManager(Path(td))
+        print(f"{'case':>16} {'legacy ms':>10} {'current ms':>11}")
+        for depth in (10, 100, 1000):
+            vars = {"v0": "x"}
+            vars.update({f"v{i}": f"${{v{i - 1}}}" for i in range(1, depth)})
+            content = f"top: ${{v{depth - 1}}}\n" * 50
+            tm.save_template("chain.py", content)
+            legacy = _time_ms(lambda: _legacy_render(content, vars), args.repeat)
+            current = _time_ms(lambda: tm.render_template("chain.py", vars), args.repeat)
+            print(f"{'chain ' + str(depth):>16} {legacy:>10.2f} {current:>11.2f}")
+            # same chain declared leaf-last: the legacy loop resolves one link per pass
+            rvars = dict(reversed(list(vars.items())))
+            legacy = _time_ms(lambda: _legacy_render(content, rvars), args.repeat)
+            current = _time_ms(lambda: tm.render_template("chain.py", rvars), args.repeat)
+            print(f"{'rev chain ' + str(depth):>16} {legacy:>10.2f} {current:>11.2f}")
+        for width in (100, 1000, 5000):
+            vars = {f"k{i}": f"value {i} of ${{base}}" for i in range(width)}
+            vars["base"] = "project"
+            content = "".join(f"# ${{k{i}}}\n" for i in range(width))
+            tm.save_template("wide.py", content)
+            legacy = _time_ms(lambda: _legacy_render(content, vars), args.repeat)
+            current = _time_ms(lambda: tm.render_template("wide.py", vars), args.repeat)
+            print(f"{'wide ' + str(width):>16} {legacy:>10.2f} {current:>11.2f}")
+
+
+def bench_many(args) -> None:
+    """
+    Render one template for `--count` variable sets: a render_template loop
+    versus render_many with 1 (in-process) and `--workers` processes.
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tm = TemplatesManager(Path(td))
+        content = (Path(__file__).resolve().parents[1] / "templates" / "NeuePythonDatei.py").read_text(encoding="utf-8")
+        tm.save_template("many.py", content + "# ${name} by ${author}, ${created}\n" * 20)
+
+        def var_sets():
+            return ({"name": f"module{i}", "author": "someone", "created": "2024-01-01",
+                     "description": "module ${name}"} for i in range(args.count))
+
+        print(f"{'mode':>16} {'renders/s':>12}")
+        t0 = time.perf_counter()
+        for vars in var_sets():
+            tm.render_template("many.py", vars)
+        print(f"{'loop':>16} {args.count / (time.perf_counter() - t0):>12.0f}")
+        for workers in [1] + args.workers:
+            for ordered in (True, False):
+                t0 = time.perf_counter()
+                for _ in tm.render_many("many.py", var_sets(), workers=workers, ordered=ordered):
+                    pass
+                mode = f"{workers}w {'ordered' if ordered else 'unordered'}"
+                print(f"{mode:>16} {args.count / (time.perf_counter() - t0):>12.0f}")
+
+
+def bench_render_to(args) -> None:
+    """
+    Peak traced memory and time for writing a large rendered module:
+    render_template + Path.write_text versus render_to(path).
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tm = TemplatesManager(Path(td) / "templates")
+        content = "".join(f"VALUE_{i} = '${{name}}-${{author}}-{i}'\n" for i in range(args.lines))
+        tm.save_template("large.py", content)
+        vars = {"name": "generated", "author": "someone"}
+        dest = Path(td) / "out.py"
+        tm.load_template("large.py")  # template read and compiled outside the measurement
+
+        def via_string():
+            dest.write_text(tm.render_template("large.py", vars), encoding="utf-8")
+
+        print(f"{'mode':>16} {'peak MiB':>10} {'ms':>10}")
+        for label, fn in (("write_text", via_string), ("render_to", lambda: tm.render_to("large.py", vars, dest))):
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{label:>16} {peak / 2 ** 20:>10.2f} {elapsed * 1e3:>10.1f}")
+
+
+def _legacy_list(templates_dir: Path) -> list:
+    """list_templates before the index: a sorted iterdir plus a stat per entry."""
+    return [p.name for p in sorted(templates_dir.iterdir()) if p.is_file() and p.name.endswith(".py")]
+
+
+def bench_list(args) -> None:
+    """list_templates over `--templates` files: legacy listing, cached index, forced refresh."""
+    with tempfile.TemporaryDirectory() as td:
+        tdir = Path(td) / "templates"
+        tm = TemplatesManager(tdir)
+        for i in range(args.templates):
+            (tdir / f"tpl{i:05}.py").write_text(f"# ${{name}} {i}\n", encoding="utf-8")
+        tm.refresh(force=True)
+        print(f"{'mode':>16} {'ms/call':>10}")
+        for label, fn in (("legacy", lambda: _legacy_list(tdir)),
+                          ("indexed", tm.list_templates),
+                          ("refresh(force)", lambda: tm.refresh(force=True))):
+            print(f"{label:>16} {_time_ms(fn, args.repeat):>10.3f}")
+
+
+def bench_bulk(args) -> None:
+    """Save `--templates` new templates with metadata: one by one, in a batch(), and with the sqlite store."""
+    print(f"{'mode':>16} {'total ms':>10}")
+    for label, meta_store, batched in (("json", "json", False), ("json batch", "json", True),
+                                       ("sqlite", "sqlite", False), ("sqlite batch", "sqlite", True)):
+        with tempfile.TemporaryDirectory() as td:
+            tm = TemplatesManager(Path(td) / "templates", meta_store=meta_store)
+            t0 = time.perf_counter()
+            if batched:
+                with tm.batch():
+                    for i in range(args.templates):
+                        tm.save_template(f"bulk{i:05}.py", "# ${name}\n", metadata={"vars": ["name"]})
+            else:
+                for i in range(args.templates):
+                    tm.save_template(f"bulk{i:05}.py", "# ${name}\n", metadata={"vars": ["name"]})
+            print(f"{label:>16} {(time.perf_counter() - t0) * 1e3:>10.0f}")
+            if meta_store == "sqlite":
+                tm._meta.close()
+
+
+def bench_startup(args) -> None:
+    """
+    Constructor cost for an existing library of `--templates` templates, as paid
+    by the GUI before its first paint: eager (reads metadata, lists and stats
+    the directory) versus lazy=True, and the deferred preload() for comparison.
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tdir = Path(td) / "templates"
+        tm = TemplatesManager(tdir)
+        with tm.batch():
+            for i in range(args.templates):
+                tm.save_template(f"tpl{i:05}.py", "# ${name}\n", metadata={"vars": ["name"]})
+        print(f"{'mode':>16} {'ms':>10}")
+        for label, fn in (("eager", lambda: TemplatesManager(tdir)),
+                          ("lazy", lambda: TemplatesManager(tdir, lazy=True)),
+                          ("lazy + preload", lambda: TemplatesManager(tdir, lazy=True).preload())):
+            print(f"{label:>16} {_time_ms(fn, args.repeat):>10.3f}")
+
+
+def bench_bundle(args) -> None:
+    """
+    Cold start over `--templates` small templates: a fresh manager lists the
+    library and loads every template, from a plain directory versus from a
+    packed bundle with an empty overlay directory.
+    """
+    with tempfile.TemporaryDirectory() as td:
+        td = Path(td)
+        tm = TemplatesManager(td / "plain")
+        with tm.batch():
+            for i in range(args.templates):
+                tm.save_template(f"tpl{i:05}.py", f"# ${{name}} {i}\n", metadata={"vars": ["name"]})
+        bundle = pack_templates(td / "plain", td / "templates.zip")
+
+        def cold(**kwargs):
+            m = TemplatesManager(**kwargs)
+            for name in m.list_templates():
+                m.load_template(name)
+
+        print(f"{'mode':>16} {'ms':>10}")
+        for label, kwargs in (("directory", {"templates_dir": td / "plain"}),
+                              ("bundle", {"templates_dir": td / "overlay", "bundle": bundle})):
+            print(f"{label:>16} {_time_ms(lambda: cold(**kwargs), max(1, args.repeat // 10)):>10.1f}")
+
+
+def bench_includes(args) -> None:
+    """
+    Warm renders of a template built from `--includes` included parts versus
+    the same text flattened into one file, plus a render right after one
+    part changed (only templates built from it are recompiled).
+    """
+    with tempfile.TemporaryDirectory() as td:
+        tm = TemplatesManager(Path(td) / "templates")
+        parts = [f"# part {i}: ${{name}} by ${{author}}\n" * 20 for i in range(args.includes)]
+        for i, part in enumerate(parts):
+            tm.save_template(f"part{i}.py", part)
+        tm.save_template("composed.py", "".join(f"#% include part{i}.py\n" for i in range(args.includes)))
+        tm.save_template("flat.py", "".join(parts))
+        vars = {"name": "demo", "author": "someone"}
+        assert tm.render_template("composed.py", vars) == tm.render_template("flat.py", vars)
+        print(f"{'mode':>16} {'ms':>10}")
+        for label, fn in (("flat", lambda: tm.render_template("flat.py", vars)),
+                          ("includes", lambda: tm.render_template("composed.py", vars))):
+            print(f"{label:>16} {_time_ms(fn, args.repeat):>10.3f}")
+
+        def edit_and_render():
+            tm.save_template("part0.py", parts[0])
+            tm.render_template("composed.py", vars)
+
+        print(f"{'edit + render':>16} {_time_ms(edit_and_render, args.repeat):>10.3f}")
+
+
+SCENARIOS = {
+    "bulk": bench_bulk,
+    "bundle": bench_bundle,
+    "expand": bench_expand,
+    "includes": bench_includes,
+    "list": bench_list,
+    "many": bench_many,
+    "render_to": bench_render_to,
+    "startup": bench_startup,
+}
+
+
+def _cli(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Benchmark templates.TemplatesManager")
+    p.add_argument("scenario", nargs="?", choices=sorted(SCENARIOS), help="Scenario to run (default: all)")
+    p.add_argument("--repeat", type=int, default=20, help="Renders per measurement")
+    p.add_argument("--count", type=int, default=20000, help="Variable sets for the 'many' scenario")
+    p.add_argument("--templates", type=int, default=10000, help="Template files for the 'list' scenario")
+    p.add_argument("--includes", type=int, default=50, help="Included parts for the 'includes' scenario")
+    p.add_argument("--lines", type=int, default=200000, help="Template lines for the 'render_to' scenario")
+    p.add_argument("--workers", nargs="+", type=int, default=[2, 4], help="Pool sizes for the 'many' scenario")
+    args = p.parse_args(argv)
+    for name in [args.scenario] if args.scenario else sorted(SCENARIOS):
+        print(f"== {name}")
+        SCENARIOS[name](args)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_cli())